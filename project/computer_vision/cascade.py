@@ -0,0 +1,170 @@
+"""Confidence based cascade of a small and a large learner trained on the same labels
+
+The small learner predicts every input. Inputs it is not confident about, where its highest
+probability is below a threshold calibrated on the validation set, are escalated to the
+large learner.
+"""
+from time import perf_counter
+
+import torch
+
+
+def check_same_vocab(small_learn, large_learn):
+    """Raise ValueError if the learners were not trained on the same labels.
+
+    :param small_learn: Fastai Learner object of the small model.
+    :param large_learn: Fastai Learner object of the large model.
+    """
+    if list(small_learn.dls.vocab) != list(large_learn.dls.vocab):
+        raise ValueError(
+            f"Learners have different labels: {small_learn.dls.vocab} and {large_learn.dls.vocab}"
+        )
+
+
+def select_threshold(small_probs, large_probs, targets, max_accuracy_drop=0.01):
+    """Select the lowest confidence threshold that keeps cascade accuracy close to the large model.
+
+    Inputs whose small model confidence is below the threshold are escalated, so the lowest
+    acceptable threshold escalates the fewest inputs.
+
+    :param small_probs: Tensor (n, classes) of small model probabilities.
+    :param large_probs: Tensor (n, classes) of large model probabilities.
+    :param targets: Tensor (n,) of label indexes.
+    :param max_accuracy_drop: Largest accuracy drop allowed against the large model.
+    :return: Float threshold, 0.0 escalates nothing and inf escalates everything.
+    """
+    n = len(targets)
+    if n == 0:
+        return 0.0
+    confidence, small_preds = small_probs.max(dim=1)
+    order = confidence.argsort()
+    confidence = confidence[order]
+    small_correct = (small_preds == targets)[order].float()
+    large_correct = (large_probs.argmax(dim=1) == targets)[order].float()
+
+    zero = torch.zeros(1)
+    # Escalating the first i inputs: large is used for [:i] and small for [i:]
+    cum_large = torch.cat([zero, large_correct.cumsum(0)])
+    cum_small = torch.cat([zero, small_correct.cumsum(0)])
+    cascade_accuracy = (cum_large + cum_small[-1] - cum_small) / n
+    target_accuracy = large_correct.mean() - max_accuracy_drop
+
+    thresholds = torch.cat([confidence, torch.tensor([float("inf")])])
+    # Only thresholds at the first of tied confidences escalate exactly i inputs
+    boundaries = torch.ones(n + 1, dtype=torch.bool)
+    boundaries[1:n] = confidence[1:] != confidence[:-1]
+
+    acceptable = boundaries & (cascade_accuracy >= target_accuracy - 1e-9)
+    first = int(acceptable.nonzero()[0])
+    return 0.0 if first == 0 else float(thresholds[first])
+
+
+def calibrate_threshold(small_learn, large_learn, items, max_accuracy_drop=0.01, bs=64):
+    """Calibrate the escalation threshold on labelled items, such as part of the validation set.
+
+    Keep the items used by cascade_report separate, the threshold is fitted to these.
+
+    :param small_learn: Fastai Learner object of the small model.
+    :param large_learn: Fastai Learner object of the large model.
+    :param items: List of labelled items such as image paths.
+    :param max_accuracy_drop: Largest accuracy drop allowed against the large model.
+    :param bs: Batch size.
+    :return: Float threshold.
+    """
+    if not len(items):
+        raise ValueError("No items to calibrate the cascade threshold on")
+    check_same_vocab(small_learn, large_learn)
+    large_probs, targets = large_learn.get_preds(
+        dl=large_learn.dls.test_dl(items, bs=bs, with_labels=True)
+    )
+    small_probs, _ = small_learn.get_preds(
+        dl=small_learn.dls.test_dl(items, bs=bs, with_labels=True)
+    )
+    threshold = select_threshold(small_probs, large_probs, targets, max_accuracy_drop)
+    print(f"Cascade threshold: {threshold:.4f} calibrated on {len(items)} items")
+    return threshold
+
+
+def cascade_predict(small_learn, large_learn, item, threshold):
+    """Predict one item, escalating to the large learner when the small one is not confident.
+
+    :param small_learn: Fastai Learner object of the small model.
+    :param large_learn: Fastai Learner object of the large model.
+    :param item: Item accepted by learn.predict, such as a PILImage or path.
+    :param threshold: Float confidence threshold from calibrate_threshold.
+    :return: Tuple with label, label_index, probabilities, escalated.
+    """
+    label, label_index, probabilities = small_learn.predict(item)
+    if probabilities.max() >= threshold:
+        return label, label_index, probabilities, False
+    label, label_index, probabilities = large_learn.predict(item)
+    return label, label_index, probabilities, True
+
+
+def cascade_predict_batch(small_learn, large_learn, items, threshold, bs=64):
+    """Predict a batch of items, escalating only the low confidence ones.
+
+    :param small_learn: Fastai Learner object of the small model.
+    :param large_learn: Fastai Learner object of the large model.
+    :param items: List of items such as image paths.
+    :param threshold: Float confidence threshold from calibrate_threshold.
+    :param bs: Batch size.
+    :return: Tuple with probabilities tensor, label index tensor, escalated boolean tensor.
+    """
+    probs, _ = small_learn.get_preds(dl=small_learn.dls.test_dl(items, bs=bs))
+    escalated = probs.max(dim=1).values < threshold
+    escalated_indexes = escalated.nonzero().flatten().tolist()
+    if escalated_indexes:
+        escalated_items = [items[i] for i in escalated_indexes]
+        large_probs, _ = large_learn.get_preds(
+            dl=large_learn.dls.test_dl(escalated_items, bs=bs)
+        )
+        probs[escalated] = large_probs
+    return probs, probs.argmax(dim=1), escalated
+
+
+def cascade_report(small_learn, large_learn, threshold, items, bs=64):
+    """Compare the cascade against running the large learner on everything.
+
+    Use items held out from calibrate_threshold, otherwise the cascade accuracy is optimistic.
+    Both paths are run once before timing so neither pays for warm up.
+
+    :param small_learn: Fastai Learner object of the small model.
+    :param large_learn: Fastai Learner object of the large model.
+    :param threshold: Float confidence threshold from calibrate_threshold.
+    :param items: List of labelled items not used for calibration.
+    :param bs: Batch size.
+    :return: Dictionary with escalation rate, accuracies and seconds for both modes.
+    """
+    if not len(items):
+        raise ValueError("No held out items to report the cascade on")
+    check_same_vocab(small_learn, large_learn)
+    warm_up_items = items[:bs]
+    large_learn.get_preds(dl=large_learn.dls.test_dl(warm_up_items, bs=bs))
+    # A threshold of inf escalates everything, so both models are warmed up
+    cascade_predict_batch(small_learn, large_learn, warm_up_items, float("inf"), bs=bs)
+
+    start = perf_counter()
+    large_probs, targets = large_learn.get_preds(
+        dl=large_learn.dls.test_dl(items, bs=bs, with_labels=True)
+    )
+    large_seconds = perf_counter() - start
+
+    start = perf_counter()
+    _, cascade_preds, escalated = cascade_predict_batch(
+        small_learn, large_learn, items, threshold, bs=bs
+    )
+    cascade_seconds = perf_counter() - start
+
+    report = {
+        "escalation_rate": escalated.float().mean().item(),
+        "large_accuracy": (large_probs.argmax(dim=1) == targets).float().mean().item(),
+        "cascade_accuracy": (cascade_preds == targets).float().mean().item(),
+        "large_seconds": large_seconds,
+        "cascade_seconds": cascade_seconds,
+        "latency_saved": 1 - cascade_seconds / large_seconds,
+    }
+    print(f"Cascade report on {len(items)} items held out from calibration")
+    for key, value in report.items():
+        print(f"{key}: {value:.4f}")
+    return report
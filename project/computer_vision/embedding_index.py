@@ -0,0 +1,401 @@
+"""Index of backbone embeddings for nearest neighbour lookup and kNN classification
+
+Pooled embeddings from a trained learner's body are L2 normalized and stored as a float16
+memory mapped matrix, with a json file mapping rows to items and labels. Cosine similarity is
+then a dot product, computed in chunks with NumPy. Large indexes can add an IVF-PQ index:
+vectors are grouped into lists by a coarse k-means, their residuals are product quantized to
+one byte per sub vector, and only the nearest lists are searched before an exact re-rank.
+"""
+import json
+from pathlib import Path
+
+import numpy as np
+import torch
+from torch import nn
+from torch.nn import functional
+
+
+def extract_embeddings(learn, items, bs=64):
+    """Yield L2 normalized average pooled embeddings of the learner's body, one batch at a time.
+
+    :param learn: Fastai Learner object with a body and head model such as from vision_learner.
+    :param items: List of items such as image paths.
+    :param bs: Batch size.
+    :return: Generator of float32 arrays (batch, dim).
+    """
+    body = learn.model[0]
+    pool = nn.AdaptiveAvgPool2d(1)
+    body.eval()
+    with torch.no_grad():
+        for batch in learn.dls.test_dl(items, bs=bs):
+            features = pool(body(batch[0])).flatten(1)
+            yield functional.normalize(features.float(), dim=1).cpu().numpy()
+
+
+def kmeans(vectors, k, iterations=10, seed=42, chunk_size=16384):
+    """Cluster vectors with Lloyd's k-means.
+
+    :param vectors: Float array (n, dim).
+    :param k: Number of clusters, at most n.
+    :param iterations: Number of assignment and update steps.
+    :param seed: Random seed for the initial centroids.
+    :param chunk_size: Rows assigned at a time, bounds memory use.
+    :return: Tuple with float32 centroids (k, dim), int assignments (n,).
+    """
+    rng = np.random.default_rng(seed)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    centroids = vectors[rng.choice(len(vectors), k, replace=False)].copy()
+    assignments = np.zeros(len(vectors), dtype=np.int64)
+    for _ in range(iterations):
+        assignments = nearest_centroids(vectors, centroids, chunk_size)
+        # Sum every cluster's members in one pass instead of scanning the vectors per cluster
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+        counts = np.bincount(assignments, minlength=k)
+        centroids = (sums / np.maximum(counts, 1)[:, None]).astype(np.float32)
+        # Empty clusters restart from a random vector
+        empty = counts == 0
+        centroids[empty] = vectors[rng.integers(len(vectors), size=int(empty.sum()))]
+    return centroids, assignments
+
+
+def nearest_centroids(vectors, centroids, chunk_size=16384):
+    """Return the index of the nearest centroid by L2 distance for every vector.
+
+    :param vectors: Float array (n, dim).
+    :param centroids: Float array (k, dim).
+    :param chunk_size: Rows assigned at a time.
+    :return: Int array (n,).
+    """
+    centroid_norms = (centroids**2).sum(axis=1)
+    assignments = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), chunk_size):
+        chunk = np.asarray(vectors[start : start + chunk_size], dtype=np.float32)
+        distances = centroid_norms - 2 * chunk @ centroids.T
+        assignments[start : start + chunk_size] = distances.argmin(axis=1)
+    return assignments
+
+
+def top_k(scores, k):
+    """Return the k highest scores of every row, best first.
+
+    :param scores: Float array (m, n).
+    :param k: Number of results per row.
+    :return: Tuple with scores (m, k), column indexes (m, k).
+    """
+    k = min(k, scores.shape[1])
+    indexes = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    top_scores = np.take_along_axis(scores, indexes, axis=1)
+    order = np.argsort(-top_scores, axis=1)
+    return np.take_along_axis(top_scores, order, axis=1), np.take_along_axis(indexes, order, axis=1)
+
+
+class IVFPQ:
+    """Inverted file index with product quantized residuals for approximate cosine search."""
+
+    def __init__(self, centroids, codebooks, codes, list_offsets, list_rows):
+        """
+        :param centroids: Float array (n_lists, dim) of coarse centroids.
+        :param codebooks: Float array (n_subvectors, n_codes, dim / n_subvectors).
+        :param codes: Uint8 array (n, n_subvectors) of codes, ordered by list.
+        :param list_offsets: Int array (n_lists + 1,) of where each list starts in codes.
+        :param list_rows: Int array (n,) of the embedding row of each code.
+        """
+        self.centroids = centroids
+        self.codebooks = codebooks
+        self.codes = codes
+        self.list_offsets = list_offsets
+        self.list_rows = list_rows
+
+    @classmethod
+    def train(cls, embeddings, n_lists=64, n_subvectors=16, n_codes=256, iterations=10, seed=42):
+        """Train coarse centroids and sub vector codebooks, then encode every embedding.
+
+        :param embeddings: Float array (n, dim), dim divisible by n_subvectors.
+        :param n_lists: Number of inverted lists.
+        :param n_subvectors: Number of sub vectors each residual is split into.
+        :param n_codes: Codes per sub vector, at most 256.
+        :param iterations: k-means iterations.
+        :param seed: Random seed.
+        :return: IVFPQ object.
+        """
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        n, dim = vectors.shape
+        if dim % n_subvectors:
+            raise ValueError(f"Embedding size {dim} is not divisible by {n_subvectors} sub vectors")
+        centroids, assignments = kmeans(vectors, min(n_lists, n), iterations, seed)
+        residuals = (vectors - centroids[assignments]).reshape(n, n_subvectors, -1)
+
+        codebooks = np.empty(
+            (n_subvectors, min(n_codes, n), dim // n_subvectors), dtype=np.float32
+        )
+        codes = np.empty((n, n_subvectors), dtype=np.uint8)
+        for sub in range(n_subvectors):
+            codebooks[sub], codes[:, sub] = kmeans(
+                residuals[:, sub], codebooks.shape[1], iterations, seed + sub + 1
+            )
+
+        list_rows = np.argsort(assignments, kind="stable")
+        list_offsets = np.searchsorted(assignments[list_rows], np.arange(len(centroids) + 1))
+        return cls(centroids, codebooks, codes[list_rows], list_offsets, list_rows)
+
+    def search(self, query, k=10, n_probe=8):
+        """Return the approximate nearest embedding rows of one query.
+
+        :param query: Float array (dim,) L2 normalized.
+        :param k: Number of candidates.
+        :param n_probe: Number of nearest lists to search.
+        :return: Int array of up to k embedding rows, nearest first.
+        """
+        n_probe = min(n_probe, len(self.centroids))
+        centroid_distances = (self.centroids**2).sum(axis=1) - 2 * self.centroids @ query
+        probed = np.argsort(centroid_distances)[:n_probe]
+        distances, rows = [], []
+        for list_index in probed:
+            start, end = self.list_offsets[list_index], self.list_offsets[list_index + 1]
+            if start == end:
+                continue
+            residual = (query - self.centroids[list_index]).reshape(len(self.codebooks), 1, -1)
+            # Asymmetric distance: squared distance of each sub vector to every code
+            table = ((self.codebooks - residual) ** 2).sum(axis=2)
+            codes = self.codes[start:end]
+            distances.append(table[np.arange(len(self.codebooks)), codes].sum(axis=1))
+            rows.append(self.list_rows[start:end])
+        if not rows:
+            return np.empty(0, dtype=np.int64)
+        distances, rows = np.concatenate(distances), np.concatenate(rows)
+        nearest = np.argsort(distances)[:k]
+        return rows[nearest]
+
+    def save(self, path):
+        """Save the index to an npz file.
+
+        :param path: Path object of the npz file.
+        """
+        np.savez(
+            path,
+            centroids=self.centroids,
+            codebooks=self.codebooks,
+            codes=self.codes,
+            list_offsets=self.list_offsets,
+            list_rows=self.list_rows,
+        )
+
+    @classmethod
+    def load(cls, path):
+        """Load an index saved with save.
+
+        :param path: Path object of the npz file.
+        :return: IVFPQ object.
+        """
+        with np.load(path) as arrays:
+            return cls(**{name: arrays[name] for name in arrays.files})
+
+
+class EmbeddingIndex:
+    """Float16 embedding matrix with the items and labels of its rows."""
+
+    embeddings_file = "embeddings.f16"
+    ids_file = "ids.json"
+    ivfpq_file = "ivfpq.npz"
+
+    def __init__(self, embeddings, items, labels, ivfpq=None, metadata=None):
+        """
+        :param embeddings: Float16 array or memmap (n, dim) of L2 normalized embeddings.
+        :param items: List of n item strings.
+        :param labels: List of n label strings.
+        :param ivfpq: (Optional) IVFPQ object, used by query when set.
+        :param metadata: (Optional) Json serializable dictionary describing how the index was built.
+        """
+        self.embeddings = embeddings
+        self.items = items
+        self.labels = labels
+        self.ivfpq = ivfpq
+        self.metadata = metadata
+
+    def __len__(self):
+        return len(self.items)
+
+    @classmethod
+    def build(cls, learn, items, index_dir, get_label=None, bs=64, metadata=None):
+        """Embed items in batches straight into a memory mapped float16 matrix.
+
+        :param learn: Fastai Learner object to take the body from.
+        :param items: List of image paths.
+        :param index_dir: Path object of the directory to write the index to.
+        :param get_label: (Optional) Callable returning an item's label (default is the parent directory name).
+        :param bs: Batch size.
+        :param metadata: (Optional) Json serializable dictionary saved with the index, such as
+            the learner and images it was built from, to tell when the index is stale.
+        :return: EmbeddingIndex object.
+        """
+        if not len(items):
+            raise ValueError("No items to index")
+        get_label = get_label or (lambda item: Path(item).parent.name)
+        index_dir.mkdir(exist_ok=True, parents=True)
+        # An IVF-PQ index trained on the previous embeddings no longer matches
+        (index_dir / cls.ivfpq_file).unlink(missing_ok=True)
+        embeddings = None
+        row = 0
+        for batch in extract_embeddings(learn, items, bs):
+            if embeddings is None:
+                embeddings = np.memmap(
+                    index_dir / cls.embeddings_file,
+                    dtype=np.float16,
+                    mode="w+",
+                    shape=(len(items), batch.shape[1]),
+                )
+            embeddings[row : row + len(batch)] = batch
+            row += len(batch)
+        embeddings.flush()
+
+        ids = {
+            "shape": list(embeddings.shape),
+            "items": [str(item) for item in items],
+            "labels": [str(get_label(item)) for item in items],
+            "metadata": metadata,
+        }
+        (index_dir / cls.ids_file).write_text(json.dumps(ids))
+        print(f"Indexed {len(items)} items with {embeddings.shape[1]} dimensional embeddings")
+        return cls.load(index_dir)
+
+    @classmethod
+    def load(cls, index_dir):
+        """Load an index, memory mapping the embeddings read only.
+
+        :param index_dir: Path object of the index directory.
+        :return: EmbeddingIndex object.
+        """
+        ids = json.loads((index_dir / cls.ids_file).read_text())
+        embeddings = np.memmap(
+            index_dir / cls.embeddings_file,
+            dtype=np.float16,
+            mode="r",
+            shape=tuple(ids["shape"]),
+        )
+        ivfpq_path = index_dir / cls.ivfpq_file
+        ivfpq = IVFPQ.load(ivfpq_path) if ivfpq_path.is_file() else None
+        return cls(embeddings, ids["items"], ids["labels"], ivfpq, ids.get("metadata"))
+
+    def train_ivfpq(self, index_dir=None, **kwargs):
+        """Train an IVF-PQ index for approximate queries, saving it if index_dir is given.
+
+        :param index_dir: (Optional) Path object of the index directory.
+        :param kwargs: Arguments passed to IVFPQ.train.
+        """
+        self.ivfpq = IVFPQ.train(self.embeddings, **kwargs)
+        if index_dir is not None:
+            self.ivfpq.save(index_dir / self.ivfpq_file)
+
+    def query(self, vectors, k=5, chunk_size=65536, n_probe=8, rerank=10):
+        """Return the top k cosine similarities of each query vector.
+
+        :param vectors: Float array (m, dim) or (dim,) of query embeddings.
+        :param k: Number of neighbours.
+        :param chunk_size: Embedding rows scored at a time by exact search.
+        :param n_probe: Lists searched per query when an IVF-PQ index is set.
+        :param rerank: Approximate candidates per neighbour re-ranked exactly with IVF-PQ.
+        :return: Tuple with scores (m, k), embedding rows (m, k), best first.
+        """
+        queries = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+        queries = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+        if self.ivfpq is not None:
+            return self._query_ivfpq(queries, k, n_probe, rerank)
+
+        best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+        best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+        for start in range(0, len(self), chunk_size):
+            chunk = np.asarray(self.embeddings[start : start + chunk_size], dtype=np.float32)
+            scores, rows = top_k(queries @ chunk.T, k)
+            # Merge the chunk's best with the best so far
+            best_scores, merged = top_k(np.hstack([best_scores, scores]), k)
+            best_rows = np.take_along_axis(np.hstack([best_rows, rows + start]), merged, axis=1)
+        return best_scores, best_rows
+
+    def _query_ivfpq(self, queries, k, n_probe, rerank):
+        """Approximate query with IVF-PQ candidates re-ranked by exact cosine similarity."""
+        all_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        all_rows = np.full((len(queries), k), -1, dtype=np.int64)
+        for i, query in enumerate(queries):
+            candidates = np.sort(self.ivfpq.search(query, k * rerank, n_probe))
+            if not len(candidates):
+                continue
+            scores = np.asarray(self.embeddings[candidates], dtype=np.float32) @ query
+            top_scores, top = top_k(scores[None], k)
+            all_scores[i, : top.shape[1]] = top_scores[0]
+            all_rows[i, : top.shape[1]] = candidates[top[0]]
+        return all_scores, all_rows
+
+    def similar(self, learn, item, k=5):
+        """Find the items most similar to an item.
+
+        :param learn: Fastai Learner object the index was built with.
+        :param item: Image path.
+        :param k: Number of similar items.
+        :return: List of (item, label, cosine similarity) tuples, most similar first.
+        """
+        query = next(extract_embeddings(learn, [item]))
+        scores, rows = self.query(query, k)
+        return [
+            (self.items[row], self.labels[row], float(score))
+            for score, row in zip(scores[0], rows[0])
+            if row >= 0
+        ]
+
+
+def knn_vote(scores, neighbour_labels, vocab):
+    """Turn neighbour similarities into label probabilities by a similarity weighted vote.
+
+    :param scores: Float array (m, k) of neighbour cosine similarities, -inf for missing neighbours.
+    :param neighbour_labels: Int array (m, k) of neighbour label indexes into vocab.
+    :param vocab: List of labels.
+    :return: Float array (m, len(vocab)) of probabilities.
+    """
+    weights = np.where(np.isfinite(scores), np.clip(scores, 0, None) + 1e-6, 0)
+    probs = np.zeros((len(scores), len(vocab)), dtype=np.float32)
+    np.add.at(probs, (np.arange(len(scores))[:, None], neighbour_labels), weights)
+    return probs / np.maximum(probs.sum(axis=1, keepdims=True), 1e-12)
+
+
+class KNNClassifier:
+    """Classify items by their nearest neighbours in an embedding index.
+
+    New categories only need their images in the index, the learner is not retrained.
+    """
+
+    def __init__(self, learn, index, k=10):
+        """
+        :param learn: Fastai Learner object the index was built with.
+        :param index: EmbeddingIndex object.
+        :param k: Number of neighbours that vote.
+        """
+        self.learn = learn
+        self.index = index
+        self.k = k
+        self.vocab = sorted(set(index.labels))
+        label_indexes = {label: i for i, label in enumerate(self.vocab)}
+        self.row_labels = np.array([label_indexes[label] for label in index.labels])
+
+    def predict_batch(self, items, bs=64):
+        """Predict a batch of items.
+
+        :param items: List of image paths.
+        :param bs: Batch size.
+        :return: Tuple with probabilities tensor, label index tensor.
+        """
+        queries = np.concatenate(list(extract_embeddings(self.learn, items, bs)))
+        scores, rows = self.index.query(queries, self.k)
+        # IVF-PQ queries mark missing neighbours with row -1 and score -inf
+        probs = knn_vote(scores, self.row_labels[np.maximum(rows, 0)], self.vocab)
+        probs = torch.from_numpy(probs)
+        return probs, probs.argmax(dim=1)
+
+    def predict(self, item):
+        """Predict one item, in the same form as learn.predict.
+
+        :param item: Image path.
+        :return: Tuple with label, label_index, probabilities.
+        """
+        probs, label_indexes = self.predict_batch([item])
+        label_index = label_indexes[0]
+        return self.vocab[label_index], label_index, probs[0]
@@ -0,0 +1,390 @@
+"""CPU execution profiles for training, batch inference and serving
+
+Each profile decides the torch intra-op and inter-op threads of a process and which CPUs the
+process and its worker processes are pinned to, so training and its dataloader workers or
+several serving workers do not oversubscribe the host. OpenMP and MKL read their thread
+environment variables when torch is imported, so apply_environment has to run before that.
+This module does not import torch at module level for the same reason.
+
+Calibrate the current host with:
+    python execution_profiles.py calibrate --mode serving
+Run a script under a profile, applied before the script imports torch, with:
+    python execution_profiles.py run --mode training main.py
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import runpy
+import sys
+from functools import partial
+from pathlib import Path
+from time import perf_counter
+
+MODES = ("training", "batch_inference", "serving")
+PROFILE_ENV_VAR = "EXECUTION_PROFILE"
+THREAD_ENV_VARS = (
+    "OMP_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS",
+)
+CALIBRATION_PATH = Path("./execution_profiles.json")
+
+
+def available_cpus():
+    """Return the CPUs this process may run on.
+
+    :return: Sorted list of CPU ids.
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def load_calibration(calibration_path=CALIBRATION_PATH):
+    """Load the calibrated settings of the current host.
+
+    :param calibration_path: Path object of the calibration json, None to ignore calibration.
+    :return: Dictionary of mode to calibrated settings, empty if not calibrated.
+    """
+    if calibration_path is None or not calibration_path.is_file():
+        return {}
+    return json.loads(calibration_path.read_text()).get(platform.node(), {})
+
+
+def profile_settings(mode, cpus=None, calibration_path=CALIBRATION_PATH, num_workers=0):
+    """Return the thread and CPU settings of a mode.
+
+    training: dataloader workers, if any, get one CPU each, torch uses the rest.
+    batch_inference: torch uses every CPU in one process.
+    serving: each worker process gets its own slice of CPUs and threads.
+
+    :param mode: One of MODES.
+    :param cpus: (Optional) List of CPU ids to use (default is every available CPU).
+    :param calibration_path: Path object of the calibration json, calibrated values win,
+        None to ignore calibration.
+    :param num_workers: Number of dataloader worker processes in training, 0 loads in the
+        main process and reserves no CPUs.
+    :return: Dictionary with intra_op_threads, inter_op_threads, main_cpus and worker_cpus,
+        a list of CPU id lists, one per worker process.
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unknown execution profile {mode}, expected one of {MODES}")
+    cpus = sorted(cpus or available_cpus())
+    calibrated = load_calibration(calibration_path).get(mode, {})
+    inter_op_threads = calibrated.get("inter_op_threads", 1)
+
+    if mode == "training":
+        # Always leave the main process at least one CPU
+        num_workers = min(num_workers, len(cpus) - 1)
+        main_cpus = cpus[: len(cpus) - num_workers]
+        worker_cpus = [[cpu] for cpu in cpus[len(main_cpus) :]]
+        # Calibrated with a different number of workers, the threads must still fit the main CPUs
+        intra_op_threads = min(calibrated.get("intra_op_threads", len(main_cpus)), len(main_cpus))
+    elif mode == "batch_inference":
+        main_cpus = cpus
+        worker_cpus = []
+        intra_op_threads = min(calibrated.get("intra_op_threads", len(cpus)), len(cpus))
+    else:
+        intra_op_threads = min(calibrated.get("intra_op_threads", 2), len(cpus))
+        main_cpus = cpus
+        worker_cpus = [
+            cpus[start : start + intra_op_threads]
+            for start in range(0, len(cpus) - intra_op_threads + 1, intra_op_threads)
+        ]
+
+    return {
+        "intra_op_threads": intra_op_threads,
+        "inter_op_threads": inter_op_threads,
+        "main_cpus": main_cpus,
+        "worker_cpus": worker_cpus,
+    }
+
+
+def set_thread_env_vars(threads, override=False):
+    """Set the OpenMP, MKL and other BLAS thread environment variables.
+
+    :param threads: Number of threads.
+    :param override: Replace variables that are already set, by default the user's values win.
+    """
+    for name in THREAD_ENV_VARS:
+        if override or name not in os.environ:
+            os.environ[name] = str(threads)
+
+
+def pin_current_process(cpus):
+    """Pin the current process to the given CPUs, where the OS supports it.
+
+    :param cpus: List of CPU ids.
+    :return: True if the process was pinned.
+    """
+    if not cpus or not hasattr(os, "sched_setaffinity"):
+        return False
+    os.sched_setaffinity(0, cpus)
+    return True
+
+
+def apply_environment(mode, num_workers=0):
+    """Set thread environment variables and pin this process for a mode, before torch is imported.
+
+    The mode is also recorded in the EXECUTION_PROFILE environment variable, for
+    apply_torch_settings and child processes.
+
+    :param mode: One of MODES.
+    :param num_workers: Number of dataloader worker processes in training.
+    :return: Dictionary of settings from profile_settings.
+    """
+    if "torch" in sys.modules:
+        print("torch is already imported, OpenMP and MKL thread variables have no effect.")
+    settings = profile_settings(mode, num_workers=num_workers)
+    set_thread_env_vars(settings["intra_op_threads"])
+    pin_current_process(settings["main_cpus"])
+    os.environ[PROFILE_ENV_VAR] = mode
+    return settings
+
+
+def apply_torch_settings(mode=None, num_workers=0):
+    """Set torch intra-op and inter-op threads for a mode.
+
+    :param mode: (Optional) One of MODES (default is the mode applied by apply_environment, or training).
+    :param num_workers: Number of dataloader worker processes in training.
+    :return: Dictionary of settings from profile_settings.
+    """
+    import torch
+
+    mode = mode or os.environ.get(PROFILE_ENV_VAR, "training")
+    settings = profile_settings(mode, num_workers=num_workers)
+    torch.set_num_threads(settings["intra_op_threads"])
+    try:
+        torch.set_num_interop_threads(settings["inter_op_threads"])
+    except RuntimeError:
+        # Can only be set once, before any inter-op parallel work has started
+        print("torch inter-op threads were already set.")
+    return settings
+
+
+def _pin_worker(worker_cpus, threads, worker_id=None):
+    """Pin a worker process to its CPU set and limit its torch threads.
+
+    Fastai calls its wif without arguments, the worker id then comes from torch.
+    """
+    import torch
+
+    if worker_id is None:
+        worker_id = torch.utils.data.get_worker_info().id
+    pin_current_process(worker_cpus[worker_id % len(worker_cpus)])
+    torch.set_num_threads(threads)
+
+
+def worker_init_fn(mode, num_workers=0):
+    """Return a worker_init_fn that pins dataloader or serving workers to the CPU sets of a mode.
+
+    :param mode: One of MODES.
+    :param num_workers: Number of dataloader worker processes in training.
+    :return: Picklable callable taking the worker id, or no argument inside a torch dataloader
+        worker, None if the mode has no worker CPUs.
+    """
+    settings = profile_settings(mode, num_workers=num_workers)
+    if not settings["worker_cpus"]:
+        return None
+    threads = len(settings["worker_cpus"][0])
+    return partial(_pin_worker, settings["worker_cpus"], threads)
+
+
+def dataloader_kwargs(num_workers=0):
+    """Return DataBlock.dataloaders keyword arguments for training dataloader workers.
+
+    Each worker is pinned to one of the CPUs the training profile reserves for it.
+
+    :param num_workers: Number of dataloader worker processes, 0 loads in the main process.
+    :return: Dictionary with num_workers and, with workers, fastai's per worker wif.
+    """
+    kwargs = {"num_workers": num_workers}
+    pin = worker_init_fn("training", num_workers) if num_workers else None
+    if pin is not None:
+        kwargs["wif"] = pin
+    return kwargs
+
+
+def _benchmark(mode, threads, inter_op_threads, cpus, batch_size, image_size, iterations, results):
+    """Measure images per second of resnet18 in a fresh process with the given settings."""
+    set_thread_env_vars(threads, override=True)
+    pin_current_process(cpus)
+    import torch
+    from torchvision.models import resnet18
+
+    torch.set_num_threads(threads)
+    torch.set_num_interop_threads(inter_op_threads)
+    model = resnet18()
+    batch = torch.randn(batch_size, 3, image_size, image_size)
+
+    def step():
+        if mode == "training":
+            model(batch).sum().backward()
+        else:
+            with torch.inference_mode():
+                model(batch)
+
+    model.train(mode == "training")
+    step()
+    start = perf_counter()
+    for _ in range(iterations):
+        step()
+    results.put(batch_size * iterations / (perf_counter() - start))
+
+
+def _run_benchmarks(mode, jobs, batch_size, image_size, iterations, timeout=600):
+    """Run (threads, inter_op_threads, cpus) jobs concurrently and return total images per second.
+
+    Returns None if a benchmark process crashed or did not finish within timeout seconds.
+    """
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    processes = [
+        context.Process(
+            target=_benchmark,
+            args=(mode, threads, inter, cpus, batch_size, image_size, iterations, results),
+        )
+        for threads, inter, cpus in jobs
+    ]
+    for process in processes:
+        process.start()
+
+    deadline = perf_counter() + timeout
+    throughputs = []
+    while len(throughputs) < len(processes) and perf_counter() < deadline:
+        try:
+            throughputs.append(results.get(timeout=1.0))
+        except queue.Empty:
+            # A crashed process never puts its result, stop waiting once every process exited
+            if not any(process.is_alive() for process in processes):
+                break
+    for process in processes:
+        process.join(timeout=max(0.0, deadline - perf_counter()))
+        if process.is_alive():
+            process.terminate()
+            process.join()
+
+    exitcodes = [process.exitcode for process in processes]
+    if len(throughputs) < len(processes) or any(exitcodes):
+        print(f"Benchmark failed with exit codes {exitcodes}")
+        return None
+    return sum(throughputs)
+
+
+def calibrate(
+    mode,
+    batch_size=None,
+    image_size=224,
+    iterations=5,
+    calibration_path=CALIBRATION_PATH,
+    num_workers=0,
+):
+    """Measure which thread settings give the best throughput for a mode on this host and save them.
+
+    :param mode: One of MODES.
+    :param batch_size: (Optional) Batch size (default is 1 for serving, 32 otherwise).
+    :param image_size: Image size.
+    :param iterations: Timed iterations per setting.
+    :param calibration_path: Path object of the calibration json to update.
+    :param num_workers: Number of dataloader worker processes in training, their CPUs are
+        left out of the benchmark.
+    :return: Dictionary of the best settings.
+    """
+    cpus = available_cpus()
+    batch_size = batch_size or (1 if mode == "serving" else 32)
+    thread_counts = sorted({2**i for i in range(len(cpus).bit_length())} | {len(cpus)})
+    default_workers = profile_settings(mode, cpus, None, num_workers)["worker_cpus"]
+
+    results = []
+    for threads in thread_counts:
+        for inter_op_threads in (1, 2):
+            if mode == "serving":
+                # Every serving worker runs at once, each on its own slice of CPUs
+                jobs = [
+                    (threads, inter_op_threads, cpus[start : start + threads])
+                    for start in range(0, len(cpus) - threads + 1, threads)
+                ]
+            elif mode == "training":
+                main_cpus = cpus[: len(cpus) - len(default_workers)]
+                if threads > len(main_cpus):
+                    continue
+                jobs = [(threads, inter_op_threads, main_cpus)]
+            else:
+                jobs = [(threads, inter_op_threads, cpus)]
+            throughput = _run_benchmarks(mode, jobs, batch_size, image_size, iterations)
+            if throughput is None:
+                continue
+            print(f"intra {threads:>3} inter {inter_op_threads} processes {len(jobs):>3}: {throughput:.1f} images/s")
+            results.append(
+                {
+                    "intra_op_threads": threads,
+                    "inter_op_threads": inter_op_threads,
+                    "images_per_second": throughput,
+                }
+            )
+
+    if not results:
+        raise RuntimeError(f"Every {mode} benchmark failed, nothing to calibrate")
+    best = max(results, key=lambda result: result["images_per_second"])
+    print(f"Best {mode} settings: {best}")
+
+    calibration = json.loads(calibration_path.read_text()) if calibration_path.is_file() else {}
+    calibration.setdefault(platform.node(), {})[mode] = best
+    calibration_path.write_text(json.dumps(calibration, indent=1))
+    return best
+
+
+def run_script(mode, script, script_args=(), num_workers=0):
+    """Apply a mode's environment, then run a script as __main__ in this process.
+
+    :param mode: One of MODES.
+    :param script: Path of the python script to run.
+    :param script_args: List of command line arguments for the script.
+    :param num_workers: Number of dataloader worker processes in training.
+    """
+    apply_environment(mode, num_workers)
+    script = Path(script).resolve()
+    sys.argv = [str(script), *script_args]
+    sys.path.insert(0, str(script.parent))
+    runpy.run_path(str(script), run_name="__main__")
+
+
+def main():
+    """Command line entry point to show or calibrate execution profiles, or run a script under one.
+
+    :return: 0
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0], allow_abbrev=False)
+    parser.add_argument("command", choices=["show", "calibrate", "run"])
+    parser.add_argument("--mode", choices=MODES, default="training")
+    parser.add_argument("--batch-size", type=int, default=None)
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--num-workers", type=int, default=0)
+    # run takes the script and its arguments after the options, everything unknown goes to it
+    args, script_args = parser.parse_known_args()
+
+    if args.command == "run":
+        if not script_args:
+            parser.error("run needs a script")
+        run_script(args.mode, script_args[0], script_args[1:], args.num_workers)
+    elif script_args:
+        parser.error(f"unrecognized arguments: {' '.join(script_args)}")
+    elif args.command == "calibrate":
+        calibrate(
+            args.mode,
+            batch_size=args.batch_size,
+            iterations=args.iterations,
+            num_workers=args.num_workers,
+        )
+    else:
+        print(json.dumps(profile_settings(args.mode, num_workers=args.num_workers), indent=1))
+    return 0
+
+
+if __name__ == "__main__":
+    main()
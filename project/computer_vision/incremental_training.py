@@ -0,0 +1,180 @@
+"""Incremental fine-tuning of an exported learner when images are added or removed
+
+A manifest of the images a learner was trained on is saved next to its export. When the images
+change, the previous learner is fine-tuned briefly on the new training images mixed with a
+replayed sample of the old ones, and only exported if its validation error does not regress.
+The validation set has to come from a stable splitter such as HashSplitter so that the errors
+before and after are measured on the same images.
+"""
+import json
+import random
+from copy import copy
+
+import torch
+# Patches fit_one_cycle onto Learner
+import fastai.callback.schedule  # noqa: F401
+from fastai.data.transforms import get_image_files
+from fastai.learner import load_learner
+
+
+def manifest_path(model_path):
+    """Return the manifest path next to an exported learner.
+
+    :param model_path: Path object of the exported learner.
+    :return: Path object of the manifest json.
+    """
+    return model_path.with_name(f"{model_path.stem}.manifest.json")
+
+
+def build_image_manifest(images_path):
+    """Build a manifest of the images in a directory.
+
+    :param images_path: Path object of the images directory.
+    :return: Dictionary of relative posix path to "size-mtime" string.
+    """
+    manifest = {}
+    for image_path in get_image_files(images_path):
+        stat = image_path.stat()
+        relative = image_path.relative_to(images_path).as_posix()
+        manifest[relative] = f"{stat.st_size}-{stat.st_mtime_ns}"
+    return manifest
+
+
+def save_manifest(model_path, manifest):
+    """Save the manifest of the images a learner was trained on.
+
+    :param model_path: Path object of the exported learner.
+    :param manifest: Dictionary from build_image_manifest.
+    """
+    manifest_path(model_path).write_text(json.dumps(manifest, indent=1, sort_keys=True))
+
+
+def load_manifest(model_path):
+    """Load the manifest saved next to an exported learner.
+
+    :param model_path: Path object of the exported learner.
+    :return: Dictionary from build_image_manifest, None if there is no manifest.
+    """
+    path = manifest_path(model_path)
+    if not path.is_file():
+        return None
+    return json.loads(path.read_text())
+
+
+def diff_manifests(old_manifest, new_manifest):
+    """Find images added or removed between two manifests, a modified image counts as both.
+
+    :param old_manifest: Dictionary from build_image_manifest.
+    :param new_manifest: Dictionary from build_image_manifest.
+    :return: Tuple with sorted list of added paths, sorted list of removed paths.
+    """
+    added = sorted(
+        path for path, stamp in new_manifest.items() if old_manifest.get(path) != stamp
+    )
+    removed = sorted(
+        path for path, stamp in old_manifest.items() if new_manifest.get(path) != stamp
+    )
+    return added, removed
+
+
+def select_replay_items(new_items, old_items, replay_ratio=1.0, seed=42):
+    """Mix new training items with a random sample of old ones so the learner does not forget them.
+
+    :param new_items: List of new training items.
+    :param old_items: List of previously trained on items.
+    :param replay_ratio: Number of old items to replay per new item.
+    :param seed: Random seed for the sample.
+    :return: List of items to train on.
+    """
+    replay_count = min(len(old_items), round(len(new_items) * replay_ratio))
+    return list(new_items) + random.Random(seed).sample(list(old_items), replay_count)
+
+
+def incremental_fine_tune(
+    model_path,
+    datablock,
+    images_path,
+    epochs=1,
+    lr=1e-4,
+    replay_ratio=1.0,
+    tolerance=0.0,
+):
+    """Fine-tune a previously exported learner on the images added since it was exported.
+
+    :param model_path: Path object of the exported learner, with a manifest next to it.
+    :param datablock: DataBlock the learner was trained with, its splitter must have is_valid.
+    :param images_path: Path object of the images directory.
+    :param epochs: Number of epochs to fine-tune for.
+    :param lr: Maximum learning rate.
+    :param replay_ratio: Number of old training images to replay per new one.
+    :param tolerance: Validation error increase still accepted.
+    :return: Fastai Learner object that is exported after the call, None if a full fine-tune is needed.
+    """
+    if not hasattr(datablock.splitter, "is_valid"):
+        raise ValueError("incremental_fine_tune needs a stable splitter such as HashSplitter")
+
+    old_manifest = load_manifest(model_path)
+    if old_manifest is None or not model_path.is_file():
+        print("No previous export with a manifest, a full fine-tune is needed.")
+        return None
+
+    new_manifest = build_image_manifest(images_path)
+    added, removed = diff_manifests(old_manifest, new_manifest)
+    print(f"Images added: {len(added)}, removed: {len(removed)}")
+
+    learn = load_learner(model_path.absolute(), cpu=not torch.cuda.is_available())
+    if not added and not removed:
+        return learn
+
+    # Checked before building datasets, a DataBlock that already built dataloaders keeps the
+    # vocab of its first data and raises on new labels instead of changing it
+    get_y = datablock.getters[datablock.n_inp]
+    labels = sorted({str(get_y(images_path / relative)) for relative in new_manifest})
+    if labels != list(learn.dls.vocab):
+        print(f"Labels changed from {learn.dls.vocab} to {labels}, a full fine-tune is needed.")
+        return None
+
+    added = set(added)
+    new_train, old_train, valid = [], [], []
+    for relative in sorted(new_manifest):
+        item = images_path / relative
+        if datablock.splitter.is_valid(item):
+            valid.append(item)
+        elif relative in added:
+            new_train.append(item)
+        else:
+            old_train.append(item)
+
+    if not new_train:
+        print("No new training images, keeping the previous learner.")
+        save_manifest(model_path, new_manifest)
+        return learn
+
+    # DataBlock.__init__ binds dataloaders to the original block, so the copy's dataloaders would
+    # still call get_items on the item list. datasets reads get_items from the copy.
+    replay_block = copy(datablock)
+    replay_block.get_items = None
+    dsets = replay_block.datasets(select_replay_items(new_train, old_train, replay_ratio) + valid)
+    dls = dsets.dataloaders(
+        after_item=datablock.item_tfms,
+        after_batch=datablock.batch_tfms,
+        **{**datablock.dls_kwargs, "num_workers": 0},
+    )
+    if list(dls.vocab) != list(learn.dls.vocab):
+        print(f"Labels changed from {learn.dls.vocab} to {dls.vocab}, a full fine-tune is needed.")
+        return None
+
+    learn.dls = dls
+    old_error = float(learn.validate()[1])
+    learn.unfreeze()
+    learn.fit_one_cycle(epochs, lr)
+    new_error = float(learn.validate()[1])
+    print(f"Validation error before: {old_error:.4f}, after: {new_error:.4f}")
+
+    if new_error > old_error + tolerance:
+        print("Validation error regressed, keeping the previous export.")
+        return load_learner(model_path.absolute(), cpu=not torch.cuda.is_available())
+
+    learn.export(model_path.absolute())
+    save_manifest(model_path, new_manifest)
+    return learn
@@ -1,42 +1,63 @@
-"""Module containing driver function and methods for fastai sandbox"""
+"""Module containing driver function and methods for fastai sandbox
+
+Run under an execution profile, applied before torch is imported, with:
+    python execution_profiles.py run --mode training main.py
+"""
 import logging
+import multiprocessing
 import platform
 import random
 import shutil
 import sys
 import traceback
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from pathlib import Path
 
+import execution_profiles
 import fastai.vision as vision
 import torch
+from cascade import calibrate_threshold, cascade_report
+from embedding_index import EmbeddingIndex, KNNClassifier
 from fastai.vision.all import (
     CategoryBlock,
     ClassificationInterpretation,
     DataBlock,
     ImageBlock,
-    ImageDataLoaders,
     PILImage,
     RandomResizedCrop,
-    RandomSplitter,
     Resize,
     URLs,
     aug_transforms,
     error_rate,
     get_image_files,
+    load_learner,
     parent_label,
     resnet34,
     untar_data,
+    using_attr,
     vision_learner,
 )
+from incremental_training import (
+    build_image_manifest,
+    incremental_fine_tune,
+    save_manifest,
+)
 from matplotlib import pyplot
+from model_pool import ModelPool
+from model_search import TRANSFORM_VARIANTS, build_search_space, run_search, train_trial
 from PIL import Image
 from setup_utils import (
     create_category_directories,
     download_images_for_categories,
     is_images_setup,
 )
+from splitters import HashSplitter, matches_split, save_split
 from torchvision.models import resnet18
 
+# Dataloader worker processes of the training builders, the training profile reserves a CPU for
+# each. 0 loads in the main process, which is needed on windows.
+DATALOADER_WORKERS = 0
 
 def try_random_image(learn, test_set_path):
     """
@@ -90,13 +111,11 @@ def bird_vs_forest_model(models_path):
     dls = DataBlock(
         blocks=[ImageBlock, CategoryBlock],
         get_items=get_image_files,
-        splitter=RandomSplitter(seed=42),
+        splitter=HashSplitter(),
         get_y=parent_label,
         item_tfms=[Resize(192, method="squish")],
         batch_tfms=aug_transforms(size=192, min_scale=0.75),
-    ).dataloaders(
-        images_path, bs=32, num_workers=0
-    )  # not sure what to set this to right now. needs to be 0 on windows
+    ).dataloaders(images_path, bs=32, **execution_profiles.dataloader_kwargs(DATALOADER_WORKERS))
 
     learn = vision.vision_learner(
         dls, resnet18, metrics=error_rate, model_dir=model_path
@@ -128,15 +147,15 @@ def cat_vs_dog_model(models_path):
     model_path = models_path / "cat_vs_dog1.pkl"
 
     path = untar_data(URLs.PETS) / "images"
-    dls = ImageDataLoaders.from_name_func(
-        models_path,
-        get_image_files(path),
-        valid_pct=0.2,
-        seed=42,
-        label_func=cat_vs_dog_label_func,
+    dls = DataBlock(
+        blocks=[ImageBlock, CategoryBlock],
+        get_items=get_image_files,
+        splitter=HashSplitter(),
+        get_y=using_attr(cat_vs_dog_label_func, "name"),
         item_tfms=Resize(224),
         batch_tfms=aug_transforms(size=224, min_scale=0.75),
-        num_workers=0,
+    ).dataloaders(
+        path, path=models_path, **execution_profiles.dataloader_kwargs(DATALOADER_WORKERS)
     )
 
     learn = vision_learner(dls, resnet34, metrics=error_rate, model_dir=model_path)
@@ -145,17 +164,16 @@ def cat_vs_dog_model(models_path):
         # dls.train.show_batch(max_n=4, nrows=1, unique=True)
         # pyplot.show()
         learn.fine_tune(1)
-        learn.export(model_path)
+        # learn.path is models_path here, so a relative path would be exported under models/models
+        learn.export(model_path.absolute())
     return learn
 
 
-def bear_model_random_resized_crop(models_path):
-    """Finetune the resnet32 model for types of bears, grizzly, black, teddy labels
+def setup_bear_images():
+    """Download the grizzly, black and teddy bear images if they are not already downloaded.
 
-    :return: Fastai Learner object
+    :return: Path object of the bear images directory.
     """
-
-    model_path = models_path / "bear1.pkl"
     images_path = Path("./images/bear")
     images_path.mkdir(exist_ok=True, parents=True)
     categories = ["grizzly bear", "black bear", "teddy bear"]
@@ -173,11 +191,25 @@ def bear_model_random_resized_crop(models_path):
             shutil.rmtree(images_path)
             logging.error(traceback.format_exc())
             sys.exit(1)
+    return images_path
+
+
+def bear_model_random_resized_crop(models_path, incremental=False):
+    """Finetune the resnet32 model for types of bears, grizzly, black, teddy labels
+
+    :param incremental: If the model is already exported, fine-tune it briefly on the images
+        added since instead of loading it as is.
+    :return: Fastai Learner object, loaded from the export if there is one trained with the same split
+    """
+
+    model_path = models_path / "bear1.pkl"
+    images_path = setup_bear_images()
+    splitter = HashSplitter()
 
     bears = DataBlock(
         blocks=[ImageBlock, CategoryBlock],
         get_items=get_image_files,
-        splitter=RandomSplitter(seed=42),
+        splitter=splitter,
         get_y=parent_label,
         item_tfms=[Resize(192)],
         batch_tfms=aug_transforms(size=192, min_scale=0.75),
@@ -192,19 +224,206 @@ def bear_model_random_resized_crop(models_path):
         item_tfms=[RandomResizedCrop(128, min_scale=0.3)],
         batch_tfms=aug_transforms(mult=2),
     )
-    dls = bears.dataloaders(images_path, num_workers=0)
+    if model_path.is_file() and not matches_split(model_path, splitter):
+        # Its validation images may be training images of the current split
+        print(f"{model_path} was trained with a different split, a full fine-tune is needed.")
+    elif model_path.is_file():
+        if not incremental:
+            return load_learner(model_path.absolute(), cpu=not torch.cuda.is_available())
+        updated_learn = incremental_fine_tune(model_path, bears, images_path)
+        if updated_learn is not None:
+            return updated_learn
+
+    # The previous export, if any, stays in place until the new one overwrites it
+    dls = bears.dataloaders(
+        images_path, **execution_profiles.dataloader_kwargs(DATALOADER_WORKERS)
+    )
     learn = vision_learner(dls, resnet34, metrics=error_rate, model_dir=model_path)
+    # Show batch before training
+    # dls.train.show_batch(max_n=4, nrows=1, unique=True)
+    # pyplot.show()
+    learn.fine_tune(4)
+    learn.export(model_path.absolute())
+    save_manifest(model_path, build_image_manifest(images_path))
+    save_split(model_path, splitter)
 
-    if not model_path.is_file():
-        # Show batch before training
-        # dls.train.show_batch(max_n=4, nrows=1, unique=True)
-        # pyplot.show()
-        learn.fine_tune(4)
-        learn.export(model_path)
+    return learn
+
+
+def bear_model_small(models_path):
+    """Finetune a low resolution resnet18 on the bear labels to use as the cheap model of a cascade
 
+    :return: Fastai Learner object, loaded from the export if there is one trained with the same split
+    """
+    model_path = models_path / "bear_small1.pkl"
+    splitter = HashSplitter()
+    if model_path.is_file() and matches_split(model_path, splitter):
+        return load_learner(model_path.absolute(), cpu=not torch.cuda.is_available())
+    images_path = setup_bear_images()
+
+    dls = DataBlock(
+        blocks=[ImageBlock, CategoryBlock],
+        get_items=get_image_files,
+        splitter=splitter,
+        get_y=parent_label,
+        item_tfms=[RandomResizedCrop(96, min_scale=0.3)],
+        batch_tfms=aug_transforms(mult=2),
+    ).dataloaders(images_path, **execution_profiles.dataloader_kwargs(DATALOADER_WORKERS))
+    learn = vision_learner(dls, resnet18, metrics=error_rate, model_dir=model_path)
+    learn.fine_tune(4)
+    learn.export(model_path.absolute())
+    save_split(model_path, splitter)
     return learn
 
 
+def bear_cascade(models_path):
+    """Calibrate a small to large bear model cascade and report its cost against the large model.
+
+    Both models are retrained if their exports were not trained with the HashSplitter split the
+    calibration and report images are taken from.
+
+    :param models_path: Path object for models directory.
+    :return: Tuple with small Learner, large Learner, threshold.
+    """
+    small_learn = bear_model_small(models_path)
+    large_learn = bear_model_random_resized_crop(models_path)
+
+    # Half of the validation images calibrate the threshold, the other half are held out for the report
+    valid_splitter = HashSplitter()
+    calibration_splitter = HashSplitter(valid_pct=0.5, salt="cascade")
+    valid_items = [
+        item for item in get_image_files(setup_bear_images()) if valid_splitter.is_valid(item)
+    ]
+    calibration_items = [item for item in valid_items if calibration_splitter.is_valid(item)]
+    report_items = [item for item in valid_items if not calibration_splitter.is_valid(item)]
+
+    threshold = calibrate_threshold(small_learn, large_learn, calibration_items)
+    cascade_report(small_learn, large_learn, threshold, report_items)
+    return small_learn, large_learn, threshold
+
+
+def bear_model_search(models_path, cpu_budget=None):
+    """Search bear transform variants, architectures and learning rates.
+
+    Weak configurations are dropped after an epoch or two with successive halving,
+    the best are trained for 4 epochs.
+
+    :param models_path: Path object for models directory to save the search results and winner.
+    :param cpu_budget: (Optional) Number of cores the search may use (default is the CPUs of the
+        training profile).
+    :return: List of ranked result dictionaries.
+    """
+    cpu_budget = cpu_budget or len(execution_profiles.available_cpus())
+    images_path = setup_bear_images()
+    export_dir = models_path / "bear_search"
+    configs = build_search_space(
+        transforms=list(TRANSFORM_VARIANTS),
+        archs=["resnet18", "resnet34"],
+        lrs=[1e-3, 2e-3],
+        max_epochs=4,
+    )
+    evaluate = partial(
+        train_trial,
+        images_path=images_path,
+        export_dir=export_dir,
+        splitter=HashSplitter(),
+    )
+    return run_search(
+        configs,
+        evaluate,
+        export_dir,
+        models_path / "bear_search_best.pkl",
+        cpu_budget=cpu_budget,
+    )
+
+
+def bear_knn_classifier(models_path, k=10):
+    """Index the bear images with the exported bear learner's embeddings and classify by nearest neighbours.
+
+    Categories added to the bear images directory are classified after rebuilding the index,
+    without retraining the learner. The index is rebuilt whenever the export or the images
+    differ from the ones it was built with.
+
+    :param models_path: Path object for models directory containing the bear export, to save the index.
+    :param k: Number of neighbours that vote.
+    :return: KNNClassifier object.
+    """
+    learn = bear_model_random_resized_crop(models_path)
+    model_path = (models_path / "bear1.pkl").absolute()
+    images_path = setup_bear_images()
+    metadata = {
+        "model_path": str(model_path),
+        "model_mtime_ns": model_path.stat().st_mtime_ns,
+        "manifest": build_image_manifest(images_path),
+    }
+
+    index_dir = models_path / "bear_index"
+    index = None
+    if (index_dir / EmbeddingIndex.ids_file).is_file():
+        index = EmbeddingIndex.load(index_dir)
+        if index.metadata != metadata:
+            print("Bear export or images changed since the index was built, rebuilding it.")
+            index = None
+    if index is None:
+        index = EmbeddingIndex.build(
+            learn, get_image_files(images_path), index_dir, metadata=metadata
+        )
+    return KNNClassifier(learn, index, k=k)
+
+
+def serving_model_pool(models_path, max_models=2, memory_budget=None):
+    """Create a model pool of the exported bear, pet and bird models.
+
+    :param models_path: Path object for models directory containing the exported models.
+    :param max_models: Maximum number of models kept loaded.
+    :param memory_budget: (Optional) Maximum bytes of weights kept loaded.
+    :return: ModelPool object.
+    """
+    pool = ModelPool(max_models=max_models, memory_budget=memory_budget)
+    pool.register("bear", models_path / "bear1.pkl")
+    pool.register("cat_vs_dog", models_path / "cat_vs_dog1.pkl")
+    pool.register("bird_vs_forest", models_path / "bird_vs_forest1.pkl")
+    return pool
+
+
+def _serving_worker(models_path, name, items, worker_id):
+    """Predict items in a serving worker process pinned to its slice of CPUs."""
+    pin = execution_profiles.worker_init_fn("serving")
+    if pin is not None:
+        pin(worker_id)
+    learn = serving_model_pool(models_path).get(name)
+    return [learn.predict(item)[0] for item in items]
+
+
+def serve_predictions(models_path, name, items):
+    """Predict items with an exported model across serving worker processes.
+
+    There is one worker per CPU slice of the serving profile. Every worker memory maps the same
+    shared weights through its model pool.
+
+    :param models_path: Path object for models directory containing the exported models.
+    :param name: String name of a model in serving_model_pool.
+    :param items: List of items accepted by learn.predict, such as image paths.
+    :return: List of labels in the order of items.
+    """
+    items = list(items)
+    worker_count = max(1, len(execution_profiles.profile_settings("serving")["worker_cpus"]))
+    worker_count = min(worker_count, len(items)) or 1
+    labels = [None] * len(items)
+    with ProcessPoolExecutor(
+        max_workers=worker_count, mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        futures = [
+            executor.submit(
+                _serving_worker, models_path, name, items[worker_id::worker_count], worker_id
+            )
+            for worker_id in range(worker_count)
+        ]
+        for worker_id, future in enumerate(futures):
+            labels[worker_id::worker_count] = future.result()
+    return labels
+
+
 def interp_experimentation(model):
     """
     Random things pertaining to using ClassificationInterpretation on a model.
@@ -221,12 +440,21 @@ def main():
     :return: 0
     """
     os_name = platform.system()
+    execution_profiles.apply_torch_settings(num_workers=DATALOADER_WORKERS)
     print(f"NVIDIA GPU available: {torch.cuda.is_available()}")
     print(f"Current cuda device: {torch.cuda.current_device()}")
     print(f"Current OS: {os_name}")
 
     models_path = Path("./models")
     bear_model = bear_model_random_resized_crop(models_path)
+    # bear_model = bear_model_random_resized_crop(models_path, incremental=True)
+    # bear_model_search(models_path)
+    # small_bear_model, bear_model, threshold = bear_cascade(models_path)
+    # pool = serving_model_pool(models_path)
+    # print(serve_predictions(models_path, "bear", get_image_files(setup_bear_images())[:16]))
+    # try_random_image(pool.get("bear"), Path('./images/bear/teddy bear'))
+    # bear_knn = bear_knn_classifier(models_path)
+    # print(bear_knn.index.similar(bear_knn.learn, Path('./images/bear/teddy bear').ls()[0]))
     # try_random_image(bear_model, Path('./images/bear/teddy bear'))
 
     return 0
@@ -0,0 +1,161 @@
+"""Pool of exported learners that share their weights across processes
+
+Each exported learner is split once into a weightless skeleton pickle and a state dict file.
+Learners are loaded from the skeleton and their weights are assigned from the state dict
+memory mapped with torch.load(mmap=True), so every process serving the same model reads the
+same page cached weights instead of holding its own copy.
+"""
+import os
+from collections import OrderedDict
+from pathlib import Path
+from time import perf_counter
+
+import torch
+from fastai.learner import load_learner
+
+
+def shared_export_paths(pkl_path):
+    """Return the skeleton and weights paths next to an exported learner.
+
+    :param pkl_path: Path object of the exported learner.
+    :return: Tuple with skeleton Path, weights Path.
+    """
+    pkl_path = Path(pkl_path)
+    return (
+        pkl_path.with_name(f"{pkl_path.stem}.skeleton.pkl"),
+        pkl_path.with_name(f"{pkl_path.stem}.weights.pt"),
+    )
+
+
+def split_export(pkl_path):
+    """Split an exported learner into a weightless skeleton and a state dict, if not already split.
+
+    :param pkl_path: Path object of the exported learner.
+    :return: Tuple with skeleton Path, weights Path.
+    """
+    pkl_path = Path(pkl_path).absolute()
+    skeleton_path, weights_path = shared_export_paths(pkl_path)
+    pkl_mtime = pkl_path.stat().st_mtime
+    if all(
+        path.is_file() and path.stat().st_mtime >= pkl_mtime
+        for path in (skeleton_path, weights_path)
+    ):
+        return skeleton_path, weights_path
+
+    # Workers starting together may split the same export, each writes its own temporary files
+    # and renames them into place so no worker can load a half written file
+    suffix = f".{os.getpid()}.tmp"
+    weights_tmp = weights_path.with_name(weights_path.name + suffix)
+    skeleton_tmp = skeleton_path.with_name(skeleton_path.name + suffix)
+    learn = load_learner(pkl_path, cpu=True)
+    torch.save(learn.model.state_dict(), weights_tmp)
+    os.replace(weights_tmp, weights_path)
+    # Meta tensors keep shapes and dtypes but no data, so the skeleton unpickles quickly
+    learn.model.to("meta")
+    learn.export(skeleton_tmp)
+    os.replace(skeleton_tmp, skeleton_path)
+    return skeleton_path, weights_path
+
+
+def load_shared_learner(pkl_path):
+    """Load an exported learner with memory mapped weights.
+
+    :param pkl_path: Path object of the exported learner.
+    :return: Fastai Learner object on the cpu.
+    """
+    skeleton_path, weights_path = split_export(pkl_path)
+    learn = load_learner(skeleton_path, cpu=True)
+    state_dict = torch.load(weights_path, mmap=True, weights_only=True)
+    learn.model.load_state_dict(state_dict, assign=True)
+    learn.model.eval()
+    return learn
+
+
+def model_nbytes(model):
+    """Return the number of bytes taken by a model's parameters and buffers.
+
+    :param model: Torch module.
+    :return: Integer number of bytes.
+    """
+    return sum(
+        tensor.numel() * tensor.element_size() for tensor in model.state_dict().values()
+    )
+
+
+class ModelPool:
+    """Keep the most recently used learners loaded, evicting by LRU over a count and memory budget."""
+
+    def __init__(self, max_models=2, memory_budget=None):
+        """
+        :param max_models: Maximum number of learners kept loaded.
+        :param memory_budget: (Optional) Maximum bytes of weights kept loaded.
+        """
+        self.max_models = max_models
+        self.memory_budget = memory_budget
+        self.paths = {}
+        self.learners = OrderedDict()
+        self.sizes = {}
+        self.hits = 0
+        self.loads = 0
+        self.evictions = 0
+        self.load_seconds = 0.0
+
+    def register(self, name, pkl_path):
+        """Register an exported learner under a name without loading it.
+
+        :param name: String name of the model.
+        :param pkl_path: Path object of the exported learner.
+        """
+        self.paths[name] = Path(pkl_path)
+
+    def get(self, name):
+        """Return the named learner, loading it and evicting others if needed.
+
+        :param name: String name of a registered model.
+        :return: Fastai Learner object.
+        """
+        if name in self.learners:
+            self.hits += 1
+            self.learners.move_to_end(name)
+            return self.learners[name]
+
+        start = perf_counter()
+        learn = load_shared_learner(self.paths[name])
+        self.load_seconds += perf_counter() - start
+        self.loads += 1
+
+        self.learners[name] = learn
+        self.sizes[name] = model_nbytes(learn.model)
+        self._evict()
+        return learn
+
+    def memory_used(self):
+        """Return the bytes of weights of the loaded learners."""
+        return sum(self.sizes.values())
+
+    def _evict(self):
+        """Evict least recently used learners until within budget, always keeping the newest."""
+        while len(self.learners) > 1 and (
+            len(self.learners) > self.max_models
+            or (self.memory_budget is not None and self.memory_used() > self.memory_budget)
+        ):
+            name, _ = self.learners.popitem(last=False)
+            del self.sizes[name]
+            self.evictions += 1
+            print(f"Evicted model {name}")
+
+    def stats(self):
+        """Return load and hit statistics.
+
+        :return: Dictionary of statistics.
+        """
+        requests = self.hits + self.loads
+        return {
+            "loaded": list(self.learners),
+            "hits": self.hits,
+            "loads": self.loads,
+            "hit_rate": self.hits / requests if requests else 0.0,
+            "evictions": self.evictions,
+            "load_seconds": self.load_seconds,
+            "memory_used": self.memory_used(),
+        }
@@ -0,0 +1,331 @@
+"""Budgeted search over DataBlock transform variants, architectures, learning rates and epochs
+
+Uses successive halving: every configuration is trained for a small number of epochs, the
+weakest are dropped, and the survivors resume from their checkpoint with a larger epoch budget
+until the largest budget is reached. Trials in the same rung run in parallel processes on the
+CPU within a CPU budget.
+"""
+import csv
+import multiprocessing
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+from pathlib import Path
+
+import torch
+from fastai.vision.all import (
+    CategoryBlock,
+    DataBlock,
+    ImageBlock,
+    RandomResizedCrop,
+    RandomSplitter,
+    Resize,
+    ResizeMethod,
+    aug_transforms,
+    error_rate,
+    get_image_files,
+    parent_label,
+    resnet18,
+    resnet34,
+    vision_learner,
+)
+
+TRANSFORM_VARIANTS = {
+    "random_resized_crop": lambda: (
+        [RandomResizedCrop(128, min_scale=0.3)],
+        aug_transforms(mult=2),
+    ),
+    "squish": lambda: (
+        [Resize(128, ResizeMethod.Squish)],
+        aug_transforms(size=128, min_scale=0.75),
+    ),
+    "pad": lambda: (
+        [Resize(128, ResizeMethod.Pad, pad_mode="zeros")],
+        aug_transforms(size=128, min_scale=0.75),
+    ),
+    "aug_mult2": lambda: ([Resize(128)], aug_transforms(mult=2)),
+}
+
+ARCHITECTURES = {"resnet18": resnet18, "resnet34": resnet34}
+
+
+def build_search_space(transforms, archs, lrs, max_epochs=4):
+    """Build every combination of the given search dimensions.
+
+    Epochs are not a search dimension, successive halving already trains the survivors
+    for growing epoch budgets up to max_epochs.
+
+    :param transforms: List of TRANSFORM_VARIANTS keys.
+    :param archs: List of ARCHITECTURES keys.
+    :param lrs: List of base learning rates.
+    :param max_epochs: Epochs the best configurations are trained for.
+    :return: List of configuration dictionaries.
+    """
+    return [
+        {"transforms": transform, "arch": arch, "lr": lr, "epochs": max_epochs}
+        for transform, arch, lr in product(transforms, archs, lrs)
+    ]
+
+
+def trial_name(config):
+    """Return a file system friendly name for a configuration.
+
+    :param config: Configuration dictionary.
+    :return: String name of the trial.
+    """
+    return f'{config["transforms"]}_{config["arch"]}_lr{config["lr"]:g}_ep{config["epochs"]}'
+
+
+def trial_checkpoint_path(export_dir, config):
+    """Return the path of the checkpoint a trial resumes from in the next rung.
+
+    :param export_dir: Path object of the directory trials are exported to.
+    :param config: Configuration dictionary.
+    :return: Path object of the checkpoint.
+    """
+    return Path(export_dir).absolute() / "checkpoints" / f"{trial_name(config)}.pth"
+
+
+def train_trial(config, epochs, images_path, export_dir=None, splitter=None, device="cpu"):
+    """Fine-tune one configuration until it has been trained for the given number of epochs.
+
+    Runs inside worker processes so everything it needs is rebuilt from the config.
+    With an export_dir, the weights are checkpointed after each rung and a later rung only
+    trains the remaining epochs, unfrozen at fine_tune's second stage learning rate. The one
+    cycle schedule restarts at every rung, so a resumed trial is close to, not the same as,
+    one fine_tune of all its epochs. The learner is exported to export_dir once it has been
+    trained for its full epochs.
+
+    :param config: Configuration dictionary from build_search_space.
+    :param epochs: Total number of epochs the trial is trained for after this call.
+    :param images_path: Path object of the images directory, one sub directory per label.
+    :param export_dir: (Optional) Path object of the directory to export fully trained trials
+        and keep checkpoints in.
+    :param splitter: (Optional) Fastai splitter, defaults to RandomSplitter(seed=42).
+    :param device: Torch device to train on, the cpu by default so parallel trials share the
+        CPU budget instead of a GPU.
+    :return: Validation error rate as a float.
+    """
+    item_tfms, batch_tfms = TRANSFORM_VARIANTS[config["transforms"]]()
+    dls = DataBlock(
+        blocks=[ImageBlock, CategoryBlock],
+        get_items=get_image_files,
+        splitter=splitter or RandomSplitter(seed=42),
+        get_y=parent_label,
+        item_tfms=item_tfms,
+        batch_tfms=batch_tfms,
+    ).dataloaders(images_path, num_workers=0, device=device)
+
+    learn = vision_learner(dls, ARCHITECTURES[config["arch"]], metrics=error_rate)
+    checkpoint_path = None if export_dir is None else trial_checkpoint_path(export_dir, config)
+    trained = 0
+    if checkpoint_path is not None and checkpoint_path.is_file():
+        checkpoint = torch.load(checkpoint_path, map_location="cpu", weights_only=True)
+        if checkpoint["epochs"] < epochs:
+            learn.model.load_state_dict(checkpoint["model"])
+            trained = checkpoint["epochs"]
+
+    with learn.no_bar(), learn.no_logging():
+        if trained:
+            # fine_tune's frozen epoch is done, continue with its unfrozen stage
+            learn.unfreeze()
+            learn.fit_one_cycle(epochs - trained, slice(config["lr"] / 200, config["lr"] / 2))
+        else:
+            learn.fine_tune(epochs, base_lr=config["lr"])
+    valid_error = float(learn.validate()[1])
+
+    if checkpoint_path is not None and epochs < config["epochs"]:
+        checkpoint_path.parent.mkdir(exist_ok=True, parents=True)
+        torch.save({"epochs": epochs, "model": learn.model.state_dict()}, checkpoint_path)
+    if export_dir is not None and epochs >= config["epochs"]:
+        learn.export(Path(export_dir).absolute() / f"{trial_name(config)}.pkl")
+    return valid_error
+
+
+def _init_worker(threads_per_worker):
+    """Limit torch threads in a worker process so the workers share the CPU budget."""
+    torch.set_num_threads(threads_per_worker)
+
+
+def _run_rung(evaluate, jobs, max_workers, threads_per_worker):
+    """Evaluate every (config, epochs) job of a rung.
+
+    Workers are spawned rather than forked, a forked child cannot use CUDA once the parent
+    initialised it.
+
+    :return: List of error rates in the same order as jobs.
+    """
+    if max_workers <= 1:
+        return [evaluate(config, epochs) for config, epochs in jobs]
+    with ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(threads_per_worker,),
+    ) as executor:
+        futures = [executor.submit(evaluate, config, epochs) for config, epochs in jobs]
+        return [future.result() for future in futures]
+
+
+def successive_halving(
+    configs,
+    evaluate,
+    min_epochs=1,
+    max_epochs=4,
+    reduction_factor=2,
+    max_workers=1,
+    threads_per_worker=1,
+):
+    """Rank configurations with successive halving.
+
+    Each rung trains the surviving configurations up to min(rung budget, config epochs) and
+    keeps the best 1/reduction_factor of them. The budget grows by reduction_factor per rung
+    until max_epochs. Configurations whose epochs did not change since the last rung are not
+    trained again.
+
+    :param configs: List of configuration dictionaries, each with an "epochs" key.
+    :param evaluate: Picklable callable (config, epochs) -> error rate, lower is better,
+        epochs is the total a configuration has been trained for after the call.
+    :param min_epochs: Epoch budget of the first rung.
+    :param max_epochs: Epoch budget of the last rung.
+    :param reduction_factor: Fraction of configurations to drop and budget growth per rung.
+    :param max_workers: Number of trials to run in parallel, 1 runs them in this process.
+    :param threads_per_worker: Torch threads for each worker process.
+    :return: List of result dictionaries (config, epochs, rung, error_rate) best first.
+    """
+    if reduction_factor < 2:
+        raise ValueError("reduction_factor must be at least 2")
+    results = [
+        {"config": config, "epochs": 0, "rung": -1, "error_rate": None}
+        for config in configs
+    ]
+    survivors = list(range(len(results)))
+    budget = min(min_epochs, max_epochs)
+    rung = 0
+
+    while survivors:
+        jobs = []
+        for index in survivors:
+            epochs = min(budget, results[index]["config"]["epochs"])
+            if epochs != results[index]["epochs"]:
+                jobs.append((index, epochs))
+
+        print(f"Rung {rung}: {len(survivors)} configurations, budget {budget} epochs")
+        errors = _run_rung(
+            evaluate,
+            [(results[index]["config"], epochs) for index, epochs in jobs],
+            max_workers,
+            threads_per_worker,
+        )
+        for (index, epochs), error in zip(jobs, errors):
+            results[index].update(epochs=epochs, error_rate=error)
+        for index in survivors:
+            results[index]["rung"] = rung
+
+        if budget >= max_epochs:
+            break
+        survivors.sort(key=lambda i: results[i]["error_rate"])
+        survivors = survivors[: max(1, len(survivors) // reduction_factor)]
+        budget = min(budget * reduction_factor, max_epochs)
+        rung += 1
+
+    return sorted(
+        (result for result in results if result["rung"] >= 0),
+        key=lambda result: (-result["rung"], result["error_rate"]),
+    )
+
+
+def format_results_table(ranked):
+    """Format ranked results as a plain text table.
+
+    :param ranked: List of result dictionaries from successive_halving.
+    :return: String table, one row per configuration.
+    """
+    header = f'{"rank":>4}  {"transforms":<20} {"arch":<9} {"lr":>8} {"epochs":>6} {"rung":>4} {"error_rate":>10}'
+    rows = [header]
+    for rank, result in enumerate(ranked, start=1):
+        config = result["config"]
+        rows.append(
+            f'{rank:>4}  {config["transforms"]:<20} {config["arch"]:<9} {config["lr"]:>8g} '
+            f'{result["epochs"]:>6} {result["rung"]:>4} {result["error_rate"]:>10.4f}'
+        )
+    return "\n".join(rows)
+
+
+def write_results_csv(ranked, csv_path):
+    """Write ranked results to a csv file.
+
+    :param ranked: List of result dictionaries from successive_halving.
+    :param csv_path: Path object of the csv file to write.
+    """
+    with open(csv_path, "w", newline="") as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(["rank", "transforms", "arch", "lr", "epochs", "rung", "error_rate"])
+        for rank, result in enumerate(ranked, start=1):
+            config = result["config"]
+            writer.writerow(
+                [
+                    rank,
+                    config["transforms"],
+                    config["arch"],
+                    config["lr"],
+                    result["epochs"],
+                    result["rung"],
+                    result["error_rate"],
+                ]
+            )
+
+
+def run_search(
+    configs,
+    evaluate,
+    export_dir,
+    winner_path,
+    cpu_budget,
+    threads_per_trial=2,
+    min_epochs=1,
+    reduction_factor=2,
+):
+    """Run successive halving, print and save the ranked table and export the winner.
+
+    :param configs: List of configuration dictionaries from build_search_space.
+    :param evaluate: Picklable callable (config, epochs) -> error rate that exports fully
+        trained trials to export_dir as {trial_name(config)}.pkl and may checkpoint them to
+        trial_checkpoint_path (see train_trial).
+    :param export_dir: Path object of the directory trials are exported to.
+    :param winner_path: Path object to copy the winning exported learner to.
+    :param cpu_budget: Number of cores the search may use, such as the length of
+        execution_profiles.available_cpus().
+    :param threads_per_trial: Torch threads for each trial.
+    :param min_epochs: Epoch budget of the first rung.
+    :param reduction_factor: Fraction of configurations to drop and budget growth per rung.
+    :return: List of ranked result dictionaries, empty if there are no configurations.
+    """
+    if not configs:
+        print("No configurations to search.")
+        return []
+    export_dir.mkdir(exist_ok=True, parents=True)
+    # Checkpoints of a previous search must not be resumed
+    checkpoint_dir = trial_checkpoint_path(export_dir, configs[0]).parent
+    shutil.rmtree(checkpoint_dir, ignore_errors=True)
+    max_workers = max(1, cpu_budget // threads_per_trial)
+
+    ranked = successive_halving(
+        configs,
+        evaluate,
+        min_epochs=min_epochs,
+        max_epochs=max(config["epochs"] for config in configs),
+        reduction_factor=reduction_factor,
+        max_workers=max_workers,
+        threads_per_worker=threads_per_trial,
+    )
+
+    shutil.rmtree(checkpoint_dir, ignore_errors=True)
+
+    print(format_results_table(ranked))
+    write_results_csv(ranked, export_dir / "results.csv")
+
+    winner_export = export_dir / f'{trial_name(ranked[0]["config"])}.pkl'
+    shutil.copyfile(winner_export, winner_path)
+    print(f"Exported winner {trial_name(ranked[0]['config'])} to {winner_path}")
+    return ranked
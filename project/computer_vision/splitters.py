@@ -0,0 +1,122 @@
+"""Fastai splitters
+
+HashSplitter puts each item in the validation set when a stable hash of its path or content
+falls below valid_pct. An item's assignment only depends on the item, so adding or removing
+images never moves existing images between train and valid.
+
+The settings of the splitter a learner was trained with are saved next to its export, so an
+export trained on a different split, whose validation images may be its training images, is
+not evaluated as if they were held out.
+"""
+import hashlib
+import json
+from pathlib import Path
+
+from fastcore.foundation import L
+
+
+def path_key(item):
+    """Return the label directory and file name of an item, independent of where the dataset lives.
+
+    :param item: Path object or string of an image.
+    :return: String key such as "grizzly bear/00000001.jpg".
+    """
+    return Path(item).parent.name + "/" + Path(item).name
+
+
+def content_key(item):
+    """Return the bytes of an item's file, so renamed or moved copies keep their assignment.
+
+    :param item: Path object or string of an image.
+    :return: Bytes of the file.
+    """
+    return Path(item).read_bytes()
+
+
+def hash_fraction(key, salt=""):
+    """Map a key to a stable float in [0, 1).
+
+    :param key: String or bytes key.
+    :param salt: String salt, changing it gives a different but equally stable split.
+    :return: Float in [0, 1).
+    """
+    if isinstance(key, str):
+        key = key.encode()
+    digest = hashlib.sha1(salt.encode() + key).digest()
+    return int.from_bytes(digest[:8], "big") / 2**64
+
+
+class HashSplitter:
+    """Split items into train and valid by a stable hash of each item.
+
+    The validation proportion matches valid_pct in expectation, closely for hundreds of items.
+    A class rather than a closure so DataBlocks using it can be pickled into worker processes.
+    """
+
+    def __init__(self, valid_pct=0.2, salt="42", key=path_key):
+        """
+        :param valid_pct: Fraction of items to put in the validation set.
+        :param salt: String salt for the hash.
+        :param key: Callable returning the string or bytes to hash for an item (path_key or content_key).
+        """
+        self.valid_pct = valid_pct
+        self.salt = salt
+        self.key = key
+
+    def describe(self):
+        """Return the settings that decide the split.
+
+        :return: Json serializable dictionary.
+        """
+        return {
+            "splitter": type(self).__name__,
+            "valid_pct": self.valid_pct,
+            "salt": self.salt,
+            "key": self.key.__name__,
+        }
+
+    def is_valid(self, item):
+        """Return True if the item belongs to the validation set."""
+        return hash_fraction(self.key(item), self.salt) < self.valid_pct
+
+    def __call__(self, items):
+        """
+        :param items: List of items.
+        :return: Tuple with L of train indexes, L of valid indexes.
+        """
+        valid = [self.is_valid(item) for item in items]
+        return (
+            L([i for i, is_valid in enumerate(valid) if not is_valid]),
+            L([i for i, is_valid in enumerate(valid) if is_valid]),
+        )
+
+
+def split_path(model_path):
+    """Return the split settings path next to an exported learner.
+
+    :param model_path: Path object of the exported learner.
+    :return: Path object of the split json.
+    """
+    return model_path.with_name(f"{model_path.stem}.split.json")
+
+
+def save_split(model_path, splitter):
+    """Save the settings of the splitter an exported learner was trained with.
+
+    :param model_path: Path object of the exported learner.
+    :param splitter: HashSplitter object.
+    """
+    split_path(model_path).write_text(json.dumps(splitter.describe(), indent=1, sort_keys=True))
+
+
+def matches_split(model_path, splitter):
+    """Return True if an exported learner was trained with the same split as the splitter.
+
+    Exports without saved split settings, such as those trained with RandomSplitter, never match.
+
+    :param model_path: Path object of the exported learner.
+    :param splitter: HashSplitter object.
+    :return: Boolean.
+    """
+    path = split_path(model_path)
+    return path.is_file() and json.loads(path.read_text()) == splitter.describe()
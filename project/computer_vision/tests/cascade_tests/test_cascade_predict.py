@@ -0,0 +1,71 @@
+"""Module contains tests for cascade_predict, cascade_predict_batch and cascade_report"""
+import unittest
+from unittest.mock import MagicMock
+
+import torch
+
+from project.computer_vision.cascade import cascade_predict, cascade_predict_batch, cascade_report
+
+
+def fake_learner(probs_by_item):
+    """Mock learner whose get_preds and predict return fixed probabilities per item"""
+    learn = MagicMock()
+    learn.dls.vocab = ["black", "grizzly"]
+    learn.dls.test_dl.side_effect = lambda items, **kwargs: list(items)
+
+    def get_preds(dl):
+        probs = torch.tensor([probs_by_item[item] for item in dl])
+        return probs, probs.argmax(dim=1)
+
+    def predict(item):
+        probs = torch.tensor(probs_by_item[item])
+        label_index = probs.argmax()
+        return learn.dls.vocab[label_index], label_index, probs
+
+    learn.get_preds.side_effect = get_preds
+    learn.predict.side_effect = predict
+    return learn
+
+
+class TestCascadePredict(unittest.TestCase):
+    def setUp(self):
+        """Small model confident on a and c, unsure on b, large model always confident"""
+        self.small = fake_learner({"a": [0.95, 0.05], "b": [0.55, 0.45], "c": [0.1, 0.9]})
+        self.large = fake_learner({"a": [0.9, 0.1], "b": [0.2, 0.8], "c": [0.3, 0.7]})
+
+    def test_cascade_predict_confident_small(self):
+        """Test a confident small prediction is not escalated"""
+        label, _, _, escalated = cascade_predict(self.small, self.large, "a", 0.8)
+        self.assertEqual("black", label)
+        self.assertFalse(escalated)
+        self.large.predict.assert_not_called()
+
+    def test_cascade_predict_escalates(self):
+        """Test an unsure small prediction is answered by the large model"""
+        label, _, probs, escalated = cascade_predict(self.small, self.large, "b", 0.8)
+        self.assertEqual("grizzly", label)
+        self.assertTrue(escalated)
+        self.assertTrue(torch.allclose(torch.tensor([0.2, 0.8]), probs))
+
+    def test_cascade_predict_batch_escalates_only_unsure(self):
+        """Test only the unsure items are sent to the large model, in one batch"""
+        probs, preds, escalated = cascade_predict_batch(self.small, self.large, ["a", "b", "c"], 0.8)
+        self.assertEqual([False, True, False], escalated.tolist())
+        self.assertEqual([0, 1, 1], preds.tolist())
+        self.assertTrue(torch.allclose(torch.tensor([0.2, 0.8]), probs[1]))
+        self.assertEqual(["b"], self.large.dls.test_dl.call_args[0][0])
+
+    def test_cascade_predict_batch_threshold_zero(self):
+        """Test a threshold of 0 never calls the large model"""
+        _, _, escalated = cascade_predict_batch(self.small, self.large, ["a", "b", "c"], 0.0)
+        self.assertFalse(escalated.any())
+        self.large.get_preds.assert_not_called()
+
+    def test_cascade_report_without_items(self):
+        """Test a report on no held out items is rejected"""
+        with self.assertRaises(ValueError):
+            cascade_report(self.small, self.large, 0.8, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+"""Module contains tests for select_threshold"""
+import math
+import unittest
+
+import torch
+
+from project.computer_vision.cascade import select_threshold
+
+
+class TestSelectThreshold(unittest.TestCase):
+    def setUp(self):
+        """Small model is wrong only on its two least confident inputs, large model is always right"""
+        self.targets = torch.tensor([0, 1, 0, 1, 0])
+        self.small_probs = torch.tensor(
+            [[0.95, 0.05], [0.1, 0.9], [0.4, 0.6], [0.55, 0.45], [0.8, 0.2]]
+        )
+        self.large_probs = torch.nn.functional.one_hot(self.targets, 2).float()
+
+    def test_select_threshold_escalates_uncertain_inputs(self):
+        """Test the threshold escalates exactly the inputs the small model gets wrong"""
+        threshold = select_threshold(self.small_probs, self.large_probs, self.targets, 0.0)
+        self.assertAlmostEqual(0.8, threshold, places=5)
+        escalated = self.small_probs.max(dim=1).values < threshold
+        self.assertEqual([False, False, True, True, False], escalated.tolist())
+
+    def test_select_threshold_allowed_drop_escalates_less(self):
+        """Test allowing an accuracy drop lowers the threshold"""
+        threshold = select_threshold(self.small_probs, self.large_probs, self.targets, 0.2)
+        self.assertAlmostEqual(0.6, threshold, places=5)
+
+    def test_select_threshold_small_always_right(self):
+        """Test nothing is escalated when the small model is as accurate as the large model"""
+        threshold = select_threshold(self.large_probs, self.large_probs, self.targets, 0.0)
+        self.assertEqual(0.0, threshold)
+
+    def test_select_threshold_small_always_wrong(self):
+        """Test everything is escalated when the small model is always wrong"""
+        wrong_probs = 1 - self.large_probs
+        wrong_probs[:, 0] += torch.arange(5) / 100
+        threshold = select_threshold(wrong_probs, self.large_probs, self.targets, 0.0)
+        self.assertTrue(math.isinf(threshold))
+
+    def test_select_threshold_no_inputs(self):
+        """Test an empty validation set escalates nothing"""
+        empty = torch.zeros(0, 2)
+        self.assertEqual(0.0, select_threshold(empty, empty, torch.zeros(0, dtype=torch.long)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+"""Module contains tests for EmbeddingIndex queries"""
+import json
+import shutil
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+from project.computer_vision.embedding_index import EmbeddingIndex
+
+
+class TestEmbeddingIndexQuery(unittest.TestCase):
+    def setUp(self):
+        """Write a small memory mapped index of random unit vectors"""
+        self.index_dir = Path("test_embedding_index")
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        rng = np.random.default_rng(0)
+        vectors = rng.standard_normal((2000, 32)).astype(np.float32)
+        self.vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+        embeddings = np.memmap(
+            self.index_dir / EmbeddingIndex.embeddings_file, dtype=np.float16, mode="w+", shape=self.vectors.shape
+        )
+        embeddings[:] = self.vectors
+        embeddings.flush()
+        ids = {
+            "shape": list(self.vectors.shape),
+            "items": [f"images/{i % 3}/{i}.jpg" for i in range(len(self.vectors))],
+            "labels": [str(i % 3) for i in range(len(self.vectors))],
+        }
+        (self.index_dir / EmbeddingIndex.ids_file).write_text(json.dumps(ids))
+        self.index = EmbeddingIndex.load(self.index_dir)
+
+    def tearDown(self):
+        """Remove the index directory"""
+        shutil.rmtree(self.index_dir, ignore_errors=True)
+
+    def exact_top_rows(self, queries, k):
+        """Brute force top k rows for comparison"""
+        return np.argsort(-(queries @ self.vectors.T), axis=1)[:, :k]
+
+    def test_load_memory_maps_float16(self):
+        """Test the loaded embeddings are a read only float16 memmap"""
+        self.assertIsInstance(self.index.embeddings, np.memmap)
+        self.assertEqual(np.float16, self.index.embeddings.dtype)
+        self.assertEqual(2000, len(self.index))
+
+    def test_load_without_metadata(self):
+        """Test an index saved without metadata loads with none"""
+        self.assertIsNone(self.index.metadata)
+
+    def test_build_without_items_raises(self):
+        """Test building an index of no items is rejected before embedding anything"""
+        with self.assertRaises(ValueError):
+            EmbeddingIndex.build(None, [], self.index_dir)
+
+    def test_query_finds_itself_first(self):
+        """Test an indexed vector is its own nearest neighbour"""
+        scores, rows = self.index.query(self.vectors[[5, 1234]], k=3)
+        self.assertEqual([5, 1234], rows[:, 0].tolist())
+        self.assertTrue(np.allclose(1.0, scores[:, 0], atol=1e-2))
+        self.assertTrue((np.diff(scores, axis=1) <= 0).all())
+
+    def test_query_chunks_match_single_pass(self):
+        """Test merging chunked results gives the exact top k"""
+        queries = self.vectors[:10] + 0.1
+        _, rows = self.index.query(queries, k=5, chunk_size=128)
+        queries = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+        self.assertEqual(self.exact_top_rows(queries, 5).tolist(), rows.tolist())
+
+    def test_query_ivfpq_recall(self):
+        """Test the IVF-PQ index finds most exact neighbours and saves with the index"""
+        self.index.train_ivfpq(self.index_dir, n_lists=16, n_subvectors=8, n_codes=64, iterations=5)
+        index = EmbeddingIndex.load(self.index_dir)
+        self.assertIsNotNone(index.ivfpq)
+
+        queries = self.vectors[:20]
+        _, rows = index.query(queries, k=5, n_probe=8)
+        exact = self.exact_top_rows(queries, 5)
+        recall = np.mean([len(set(a) & set(b)) / 5 for a, b in zip(rows.tolist(), exact.tolist())])
+        self.assertGreater(recall, 0.6)
+        self.assertEqual(list(range(20)), rows[:, 0].tolist())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+"""Module contains tests for kmeans"""
+import unittest
+
+import numpy as np
+
+from project.computer_vision.embedding_index import kmeans
+
+
+class TestKmeans(unittest.TestCase):
+    def setUp(self):
+        """Three well separated blobs of points"""
+        rng = np.random.default_rng(0)
+        centers = np.array([[0.0, 0.0], [10.0, 0.0], [0.0, 10.0]], dtype=np.float32)
+        self.vectors = np.concatenate([center + rng.standard_normal((50, 2)) for center in centers])
+
+    def test_centroids_are_cluster_means(self):
+        """Test every centroid is the mean of the vectors assigned to it"""
+        centroids, assignments = kmeans(self.vectors, 3)
+        self.assertEqual(np.float32, centroids.dtype)
+        for cluster in range(3):
+            np.testing.assert_allclose(
+                self.vectors[assignments == cluster].mean(axis=0), centroids[cluster], rtol=1e-5
+            )
+
+    def test_finds_separated_clusters(self):
+        """Test each blob ends up in its own cluster"""
+        _, assignments = kmeans(self.vectors, 3)
+        blobs = [set(assignments[start : start + 50]) for start in range(0, 150, 50)]
+        self.assertTrue(all(len(blob) == 1 for blob in blobs))
+        self.assertEqual(3, len(set.union(*blobs)))
+
+    def test_empty_clusters_restart(self):
+        """Test duplicate vectors leaving clusters empty still give k finite centroids"""
+        centroids, assignments = kmeans(np.ones((10, 2), dtype=np.float32), 4)
+        self.assertEqual((4, 2), centroids.shape)
+        self.assertTrue(np.isfinite(centroids).all())
+        self.assertEqual(10, len(assignments))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+"""Module contains tests for EmbeddingIndex.build, similar and KNNClassifier"""
+import shutil
+import unittest
+from pathlib import Path
+
+import numpy as np
+import torch
+from fastai.data.all import CategoryBlock, DataBlock, get_image_files, parent_label
+from fastai.learner import Learner
+from fastai.vision.data import ImageBlock
+from PIL import Image
+from torch import nn
+
+from project.computer_vision.embedding_index import EmbeddingIndex, KNNClassifier
+
+
+class TestKNNClassifier(unittest.TestCase):
+    def setUp(self):
+        """A tiny body and head learner and an index of dark and bright images"""
+        self.test_dir = Path("test_knn_classifier").absolute()
+        self.index_dir = self.test_dir / "index"
+        images_path = self.test_dir / "images"
+        rng = np.random.default_rng(0)
+        for label, value in [("dark", 30), ("bright", 220)]:
+            (images_path / label).mkdir(parents=True, exist_ok=True)
+            for i in range(12):
+                pixels = np.clip(rng.integers(-20, 20, (8, 8, 3)) + value, 0, 255)
+                Image.fromarray(pixels.astype(np.uint8)).save(images_path / label / f"{i:03}.png")
+        self.items = get_image_files(images_path)
+
+        torch.manual_seed(0)
+        dls = DataBlock(
+            blocks=(ImageBlock, CategoryBlock), get_items=get_image_files, get_y=parent_label
+        ).dataloaders(images_path, bs=8, num_workers=0)
+        body = nn.Sequential(nn.Conv2d(3, 8, 3), nn.ReLU())
+        head = nn.Sequential(nn.AdaptiveAvgPool2d(1), nn.Flatten(), nn.Linear(8, 2))
+        self.learn = Learner(dls, nn.Sequential(body, head))
+        self.index = EmbeddingIndex.build(
+            self.learn, self.items, self.index_dir, bs=8, metadata={"model": "tiny"}
+        )
+
+    def tearDown(self):
+        """Remove the images and the index"""
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def test_build_writes_every_item(self):
+        """Test every item is embedded, labelled by its directory and saved with the metadata"""
+        index = EmbeddingIndex.load(self.index_dir)
+        self.assertEqual((len(self.items), 8), index.embeddings.shape)
+        self.assertEqual([item.parent.name for item in self.items], index.labels)
+        self.assertEqual({"model": "tiny"}, index.metadata)
+        norms = np.linalg.norm(np.asarray(index.embeddings, dtype=np.float32), axis=1)
+        self.assertTrue(np.allclose(1.0, norms, atol=1e-2))
+
+    def test_rebuild_removes_stale_ivfpq(self):
+        """Test rebuilding drops an IVF-PQ index trained on the previous embeddings"""
+        self.index.train_ivfpq(self.index_dir, n_lists=4, n_subvectors=4, n_codes=8, iterations=3)
+        index = EmbeddingIndex.build(self.learn, self.items, self.index_dir, bs=8)
+        self.assertIsNone(index.ivfpq)
+        self.assertFalse((self.index_dir / EmbeddingIndex.ivfpq_file).exists())
+
+    def test_similar_finds_its_own_label(self):
+        """Test an indexed item is among its most similar items, which share its label"""
+        similar = self.index.similar(self.learn, self.items[3], k=3)
+        self.assertEqual(3, len(similar))
+        self.assertIn(str(self.items[3]), [item for item, _, _ in similar])
+        self.assertEqual({self.items[3].parent.name}, {label for _, label, _ in similar})
+        self.assertAlmostEqual(1.0, similar[0][2], places=2)
+
+    def test_predict_batch_matches_labels(self):
+        """Test the neighbours vote for the label of each indexed item"""
+        knn = KNNClassifier(self.learn, self.index, k=3)
+        probs, label_indexes = knn.predict_batch(self.items)
+        self.assertEqual(["bright", "dark"], knn.vocab)
+        self.assertEqual([item.parent.name for item in self.items], [knn.vocab[i] for i in label_indexes])
+        self.assertTrue(torch.allclose(torch.ones(len(self.items)), probs.sum(dim=1)))
+
+    def test_predict_single_item(self):
+        """Test predict returns label, label index and probabilities like learn.predict"""
+        label, label_index, probs = KNNClassifier(self.learn, self.index, k=3).predict(self.items[0])
+        self.assertEqual(self.items[0].parent.name, label)
+        self.assertEqual(label_index, probs.argmax())
+
+    def test_predict_with_missing_ivfpq_neighbours(self):
+        """Test neighbours missing from IVF-PQ results, row -1, do not vote"""
+        self.index.train_ivfpq(n_lists=4, n_subvectors=4, n_codes=8, iterations=3)
+        k = len(self.items) + 1
+        _, rows = self.index.query(np.asarray(self.index.embeddings[:2], dtype=np.float32), k=k)
+        self.assertTrue((rows == -1).any())
+
+        probs, label_indexes = KNNClassifier(self.learn, self.index, k=k).predict_batch(self.items)
+        self.assertTrue(torch.isfinite(probs).all())
+        self.assertTrue(torch.allclose(torch.ones(len(self.items)), probs.sum(dim=1)))
+        self.assertEqual(len(self.items), len(label_indexes))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+"""Module contains tests for knn_vote"""
+import unittest
+
+import numpy as np
+
+from project.computer_vision.embedding_index import knn_vote
+
+
+class TestKnnVote(unittest.TestCase):
+    def setUp(self):
+        """Labels of the neighbours"""
+        self.vocab = ["black bear", "grizzly bear", "teddy bear"]
+
+    def test_knn_vote_majority(self):
+        """Test the label of most similar neighbours wins"""
+        scores = np.array([[0.9, 0.8, 0.3]])
+        labels = np.array([[2, 2, 0]])
+        probs = knn_vote(scores, labels, self.vocab)
+        self.assertEqual(2, probs.argmax())
+        self.assertAlmostEqual(1.0, probs.sum(), places=5)
+        self.assertEqual(0.0, probs[0, 1])
+
+    def test_knn_vote_weighted_by_similarity(self):
+        """Test one very similar neighbour outweighs two dissimilar ones"""
+        scores = np.array([[0.95, 0.2, 0.2]])
+        labels = np.array([[1, 0, 0]])
+        self.assertEqual(1, knn_vote(scores, labels, self.vocab).argmax())
+
+    def test_knn_vote_ignores_missing_neighbours(self):
+        """Test neighbours with -inf score do not vote"""
+        scores = np.array([[0.5, -np.inf]])
+        labels = np.array([[0, 2]])
+        probs = knn_vote(scores, labels, self.vocab)
+        self.assertEqual(0.0, probs[0, 2])
+        self.assertAlmostEqual(1.0, probs[0, 0], places=5)
+
+
+if __name__ == '__main__':
+    unittest.main()
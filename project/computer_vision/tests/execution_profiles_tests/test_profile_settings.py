@@ -0,0 +1,81 @@
+"""Module contains tests for profile_settings"""
+import json
+import platform
+import unittest
+from pathlib import Path
+
+from project.computer_vision.execution_profiles import profile_settings
+
+
+class TestProfileSettings(unittest.TestCase):
+    def setUp(self):
+        """Sixteen fake CPUs and a calibration file path"""
+        self.cpus = list(range(16))
+        self.calibration_path = Path("test_execution_profiles.json")
+
+    def tearDown(self):
+        """Remove the calibration file"""
+        self.calibration_path.unlink(missing_ok=True)
+
+    def test_training_gives_dataloader_workers_own_cpus(self):
+        """Test training keeps dataloader worker CPUs out of the torch threads"""
+        settings = profile_settings("training", self.cpus, None, num_workers=4)
+        self.assertEqual(list(range(12)), settings["main_cpus"])
+        self.assertEqual([[12], [13], [14], [15]], settings["worker_cpus"])
+        self.assertEqual(12, settings["intra_op_threads"])
+
+    def test_training_without_workers_reserves_no_cpus(self):
+        """Test training loading in the main process gives torch every CPU"""
+        settings = profile_settings("training", self.cpus, None)
+        self.assertEqual(self.cpus, settings["main_cpus"])
+        self.assertEqual([], settings["worker_cpus"])
+        self.assertEqual(16, settings["intra_op_threads"])
+
+    def test_training_keeps_a_cpu_for_the_main_process(self):
+        """Test more workers than CPUs still leaves the main process one CPU"""
+        settings = profile_settings("training", [0, 1], None, num_workers=4)
+        self.assertEqual([0], settings["main_cpus"])
+        self.assertEqual([[1]], settings["worker_cpus"])
+
+    def test_batch_inference_uses_every_cpu(self):
+        """Test batch inference runs one process on every CPU"""
+        settings = profile_settings("batch_inference", self.cpus, None)
+        self.assertEqual(16, settings["intra_op_threads"])
+        self.assertEqual([], settings["worker_cpus"])
+
+    def test_serving_splits_cpus_between_workers(self):
+        """Test serving workers get disjoint CPU sets matching their threads"""
+        settings = profile_settings("serving", self.cpus, None)
+        self.assertEqual(8, len(settings["worker_cpus"]))
+        self.assertEqual(self.cpus, sorted(sum(settings["worker_cpus"], [])))
+        self.assertTrue(all(len(cpus) == settings["intra_op_threads"] for cpus in settings["worker_cpus"]))
+
+    def test_calibrated_settings_win(self):
+        """Test calibrated settings for this host replace the defaults"""
+        calibration = {platform.node(): {"serving": {"intra_op_threads": 4, "inter_op_threads": 2}}}
+        self.calibration_path.write_text(json.dumps(calibration))
+        settings = profile_settings("serving", self.cpus, self.calibration_path)
+        self.assertEqual(4, settings["intra_op_threads"])
+        self.assertEqual(2, settings["inter_op_threads"])
+        self.assertEqual(4, len(settings["worker_cpus"]))
+
+    def test_calibrated_threads_fit_main_cpus(self):
+        """Test training threads calibrated without workers do not spill onto worker CPUs"""
+        calibration = {platform.node(): {"training": {"intra_op_threads": 16}}}
+        self.calibration_path.write_text(json.dumps(calibration))
+        settings = profile_settings("training", self.cpus, self.calibration_path, num_workers=4)
+        self.assertEqual(12, settings["intra_op_threads"])
+
+    def test_single_cpu(self):
+        """Test every mode still gets one thread on a single CPU"""
+        for mode in ["training", "batch_inference", "serving"]:
+            self.assertEqual(1, profile_settings(mode, [0], None)["intra_op_threads"])
+
+    def test_unknown_mode(self):
+        """Test an unknown mode is rejected"""
+        with self.assertRaises(ValueError):
+            profile_settings("gaming", self.cpus, None)
+
+
+if __name__ == '__main__':
+    unittest.main()
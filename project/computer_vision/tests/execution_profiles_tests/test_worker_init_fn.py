@@ -0,0 +1,58 @@
+"""Module contains tests for worker_init_fn and dataloader_kwargs"""
+import pickle
+import unittest
+from unittest.mock import MagicMock, patch
+
+from project.computer_vision.execution_profiles import dataloader_kwargs, worker_init_fn
+
+
+@patch('project.computer_vision.execution_profiles.load_calibration', return_value={})
+@patch('project.computer_vision.execution_profiles.available_cpus', return_value=list(range(16)))
+@patch('project.computer_vision.execution_profiles.pin_current_process')
+@patch('torch.set_num_threads')
+class TestWorkerInitFn(unittest.TestCase):
+    def test_serving_workers_pinned_to_own_slice(self, mock_threads, mock_pin, mock_cpus, mock_calibration):
+        """Test each serving worker id is pinned to its own CPU slice and thread count"""
+        pin = worker_init_fn("serving")
+        pin(0)
+        mock_pin.assert_called_with([0, 1])
+        pin(3)
+        mock_pin.assert_called_with([6, 7])
+        mock_threads.assert_called_with(2)
+
+    def test_training_workers_pinned_to_reserved_cpus(self, mock_threads, mock_pin, mock_cpus, mock_calibration):
+        """Test training dataloader workers are pinned to the CPUs reserved for them"""
+        pin = worker_init_fn("training", num_workers=4)
+        pin(1)
+        mock_pin.assert_called_with([13])
+        mock_threads.assert_called_with(1)
+
+    def test_worker_id_from_torch_without_argument(self, mock_threads, mock_pin, mock_cpus, mock_calibration):
+        """Test fastai's argument free wif takes the worker id from torch"""
+        pin = worker_init_fn("training", num_workers=4)
+        with patch('torch.utils.data.get_worker_info', return_value=MagicMock(id=2)):
+            pin()
+        mock_pin.assert_called_with([14])
+
+    def test_no_worker_cpus(self, mock_threads, mock_pin, mock_cpus, mock_calibration):
+        """Test modes without worker CPUs need no worker_init_fn"""
+        self.assertIsNone(worker_init_fn("batch_inference"))
+        self.assertIsNone(worker_init_fn("training"))
+
+    def test_worker_init_fn_pickles(self, mock_threads, mock_pin, mock_cpus, mock_calibration):
+        """Test the worker_init_fn can be sent to spawned worker processes"""
+        pin = pickle.loads(pickle.dumps(worker_init_fn("serving")))
+        pin(1)
+        mock_pin.assert_called_with([2, 3])
+
+    def test_dataloader_kwargs(self, mock_threads, mock_pin, mock_cpus, mock_calibration):
+        """Test dataloader workers get a wif and loading in the main process does not"""
+        self.assertEqual({"num_workers": 0}, dataloader_kwargs())
+        kwargs = dataloader_kwargs(4)
+        self.assertEqual(4, kwargs["num_workers"])
+        kwargs["wif"](0)
+        mock_pin.assert_called_with([12])
+
+
+if __name__ == '__main__':
+    unittest.main()
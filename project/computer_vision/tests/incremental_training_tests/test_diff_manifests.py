@@ -0,0 +1,37 @@
+"""Module contains tests for diff_manifests"""
+import unittest
+
+from project.computer_vision.incremental_training import diff_manifests
+
+
+class TestDiffManifests(unittest.TestCase):
+    def setUp(self):
+        """Manifest of the images a learner was trained on"""
+        self.old_manifest = {"grizzly/1.jpg": "10-1", "grizzly/2.jpg": "20-1", "teddy/1.jpg": "30-1"}
+
+    def test_diff_manifests_unchanged(self):
+        """Test no changes are found for the same manifest"""
+        self.assertEqual(([], []), diff_manifests(self.old_manifest, dict(self.old_manifest)))
+
+    def test_diff_manifests_added_and_removed(self):
+        """Test added and removed images are found"""
+        new_manifest = dict(self.old_manifest)
+        del new_manifest["grizzly/2.jpg"]
+        new_manifest["black/1.jpg"] = "40-2"
+        self.assertEqual((["black/1.jpg"], ["grizzly/2.jpg"]), diff_manifests(self.old_manifest, new_manifest))
+
+    def test_diff_manifests_modified(self):
+        """Test a modified image counts as removed and added"""
+        new_manifest = dict(self.old_manifest)
+        new_manifest["teddy/1.jpg"] = "31-2"
+        self.assertEqual((["teddy/1.jpg"], ["teddy/1.jpg"]), diff_manifests(self.old_manifest, new_manifest))
+
+    def test_diff_manifests_no_previous_images(self):
+        """Test every image is added against an empty manifest"""
+        added, removed = diff_manifests({}, self.old_manifest)
+        self.assertEqual(sorted(self.old_manifest), added)
+        self.assertEqual([], removed)
+
+
+if __name__ == '__main__':
+    unittest.main()
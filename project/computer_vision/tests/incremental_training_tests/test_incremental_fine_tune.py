@@ -0,0 +1,115 @@
+"""Module contains tests for incremental_fine_tune"""
+import shutil
+import unittest
+from pathlib import Path
+
+import numpy as np
+from fastai.data.all import CategoryBlock, DataBlock, get_image_files, parent_label
+from fastai.learner import Learner
+from fastai.metrics import error_rate
+from fastai.vision.data import ImageBlock
+from PIL import Image
+from torch import nn
+
+from project.computer_vision.incremental_training import (
+    build_image_manifest,
+    incremental_fine_tune,
+    load_manifest,
+    save_manifest,
+)
+from project.computer_vision.splitters import HashSplitter
+
+
+class TestIncrementalFineTune(unittest.TestCase):
+    def setUp(self):
+        """Export a tiny learner trained on dark and bright images, with its manifest"""
+        self.test_dir = Path("test_incremental_fine_tune").absolute()
+        self.images_path = self.test_dir / "images"
+        self.model_path = self.test_dir / "tiny.pkl"
+        self.rng = np.random.default_rng(0)
+        self.splitter = HashSplitter(valid_pct=0.3)
+        for label in ["dark", "bright"]:
+            self.add_images(label, 12)
+
+        self.datablock = DataBlock(
+            blocks=(ImageBlock, CategoryBlock),
+            get_items=get_image_files,
+            splitter=self.splitter,
+            get_y=parent_label,
+        )
+        dls = self.datablock.dataloaders(self.images_path, bs=8, num_workers=0)
+        model = nn.Sequential(nn.Flatten(), nn.Linear(3 * 8 * 8, 2))
+        learn = Learner(dls, model, metrics=error_rate)
+        with learn.no_logging():
+            learn.fit(1)
+        learn.export(self.model_path)
+        save_manifest(self.model_path, build_image_manifest(self.images_path))
+        self.export_mtime = self.model_path.stat().st_mtime_ns
+
+    def tearDown(self):
+        """Remove the images and exported files"""
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def add_images(self, label, count, valid=None, prefix="old"):
+        """Write count 8x8 images of a label, optionally only train or only valid ones"""
+        directory = self.images_path / label
+        directory.mkdir(parents=True, exist_ok=True)
+        value = 30 if label == "dark" else 220
+        written, i = [], 0
+        while len(written) < count:
+            path = directory / f"{prefix}{i:03}.png"
+            i += 1
+            if valid is not None and self.splitter.is_valid(path) != valid:
+                continue
+            pixels = np.clip(self.rng.integers(-20, 20, (8, 8, 3)) + value, 0, 255)
+            Image.fromarray(pixels.astype(np.uint8)).save(path)
+            written.append(path)
+        return written
+
+    def fine_tune(self, **kwargs):
+        """Run incremental_fine_tune on the test export"""
+        return incremental_fine_tune(self.model_path, self.datablock, self.images_path, **kwargs)
+
+    def test_exports_when_error_does_not_regress(self):
+        """Test new training images are trained on and the export and manifest are updated"""
+        added = self.add_images("bright", 4, valid=False, prefix="new")
+        learn = self.fine_tune(tolerance=1.0)
+
+        self.assertIsNotNone(learn)
+        self.assertNotEqual(self.export_mtime, self.model_path.stat().st_mtime_ns)
+        self.assertEqual(build_image_manifest(self.images_path), load_manifest(self.model_path))
+        self.assertTrue(set(added) <= set(learn.dls.train_ds.items))
+
+    def test_keeps_export_when_error_regresses(self):
+        """Test a regressed learner is not exported and the manifest is not updated"""
+        self.add_images("bright", 4, valid=False, prefix="new")
+        old_manifest = load_manifest(self.model_path)
+        learn = self.fine_tune(tolerance=-1.0)
+
+        self.assertIsNotNone(learn)
+        self.assertEqual(self.export_mtime, self.model_path.stat().st_mtime_ns)
+        self.assertEqual(old_manifest, load_manifest(self.model_path))
+
+    def test_new_label_needs_full_fine_tune(self):
+        """Test images of a new label fall back to a full fine-tune"""
+        self.add_images("grey", 12, prefix="new")
+        self.assertIsNone(self.fine_tune())
+        self.assertEqual(self.export_mtime, self.model_path.stat().st_mtime_ns)
+
+    def test_only_valid_images_added(self):
+        """Test added validation images only update the manifest"""
+        self.add_images("dark", 3, valid=True, prefix="new")
+        learn = self.fine_tune()
+
+        self.assertIsNotNone(learn)
+        self.assertEqual(self.export_mtime, self.model_path.stat().st_mtime_ns)
+        self.assertEqual(build_image_manifest(self.images_path), load_manifest(self.model_path))
+
+    def test_without_manifest_needs_full_fine_tune(self):
+        """Test an export without a manifest falls back to a full fine-tune"""
+        (self.test_dir / "tiny.manifest.json").unlink()
+        self.assertIsNone(self.fine_tune())
+
+
+if __name__ == '__main__':
+    unittest.main()
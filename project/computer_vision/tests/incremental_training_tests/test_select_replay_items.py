@@ -0,0 +1,38 @@
+"""Module contains tests for select_replay_items"""
+import unittest
+
+from project.computer_vision.incremental_training import select_replay_items
+
+
+class TestSelectReplayItems(unittest.TestCase):
+    def setUp(self):
+        """New and old training items"""
+        self.new_items = ["new1", "new2"]
+        self.old_items = [f"old{i}" for i in range(10)]
+
+    def test_select_replay_items_ratio(self):
+        """Test the number of old items replayed follows the ratio"""
+        result = select_replay_items(self.new_items, self.old_items, replay_ratio=2)
+        self.assertEqual(self.new_items, result[:2])
+        self.assertEqual(4, len(result[2:]))
+        self.assertTrue(set(result[2:]) <= set(self.old_items))
+
+    def test_select_replay_items_more_than_available(self):
+        """Test replay is capped at the number of old items"""
+        result = select_replay_items(self.new_items, self.old_items, replay_ratio=100)
+        self.assertEqual(12, len(result))
+
+    def test_select_replay_items_deterministic(self):
+        """Test the same seed replays the same old items"""
+        self.assertEqual(
+            select_replay_items(self.new_items, self.old_items, seed=1),
+            select_replay_items(self.new_items, self.old_items, seed=1),
+        )
+
+    def test_select_replay_items_no_old_items(self):
+        """Test only new items are returned when there is nothing to replay"""
+        self.assertEqual(self.new_items, select_replay_items(self.new_items, []))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+"""Module contains tests for split_export and load_shared_learner"""
+import shutil
+import unittest
+from pathlib import Path
+
+import torch
+from fastai.data.all import DataBlock, ItemGetter, RegressionBlock
+from fastai.learner import Learner
+from torch import nn
+from torch.nn import functional
+
+from project.computer_vision.model_pool import load_shared_learner, shared_export_paths, split_export
+
+
+class TestLoadSharedLearner(unittest.TestCase):
+    def setUp(self):
+        """Export a tiny trained learner with parameters and batch norm buffers"""
+        self.test_dir = Path("test_load_shared_learner").absolute()
+        self.test_dir.mkdir(parents=True, exist_ok=True)
+        self.pkl_path = self.test_dir / "tiny.pkl"
+
+        items = [([float(i)], [2.0 * i]) for i in range(32)]
+        dls = DataBlock(
+            blocks=(RegressionBlock, RegressionBlock), get_x=ItemGetter(0), get_y=ItemGetter(1)
+        ).dataloaders(items, bs=8, num_workers=0)
+        model = nn.Sequential(nn.Linear(1, 4), nn.BatchNorm1d(4), nn.Linear(4, 1))
+        self.learn = Learner(dls, model, loss_func=functional.mse_loss)
+        with self.learn.no_logging():
+            self.learn.fit(1)
+        self.learn.export(self.pkl_path)
+
+    def tearDown(self):
+        """Remove the exported files"""
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def test_split_export_writes_skeleton_without_weights(self):
+        """Test the skeleton holds meta tensors and the weights file holds the state dict"""
+        skeleton_path, weights_path = split_export(self.pkl_path)
+
+        self.assertEqual((skeleton_path, weights_path), shared_export_paths(self.pkl_path))
+        skeleton = torch.load(skeleton_path, weights_only=False)
+        self.assertTrue(all(p.is_meta for p in skeleton.model.parameters()))
+        state_dict = torch.load(weights_path, weights_only=True)
+        self.assertEqual(set(self.learn.model.state_dict()), set(state_dict))
+        self.assertEqual([], list(self.test_dir.glob("*.tmp")))
+
+    def test_split_export_reuses_up_to_date_split(self):
+        """Test an existing split newer than the export is not written again"""
+        _, weights_path = split_export(self.pkl_path)
+        mtime = weights_path.stat().st_mtime_ns
+        split_export(self.pkl_path)
+        self.assertEqual(mtime, weights_path.stat().st_mtime_ns)
+
+    def test_load_shared_learner_round_trip(self):
+        """Test the loaded learner has the exported weights and predicts the same"""
+        learn = load_shared_learner(self.pkl_path)
+
+        for name, tensor in self.learn.model.state_dict().items():
+            loaded = learn.model.state_dict()[name]
+            self.assertFalse(loaded.is_meta)
+            self.assertTrue(torch.equal(tensor.cpu(), loaded))
+        x = torch.randn(8, 1)
+        self.assertTrue(torch.allclose(self.learn.model.cpu().eval()(x), learn.model(x)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+"""Module contains tests for ModelPool"""
+import unittest
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+from project.computer_vision.model_pool import ModelPool
+
+
+@patch('project.computer_vision.model_pool.model_nbytes', return_value=100)
+@patch('project.computer_vision.model_pool.load_shared_learner')
+class TestModelPool(unittest.TestCase):
+    def setUp(self):
+        """Register three fake exported models"""
+        self.pool = ModelPool(max_models=2)
+        for name in ["bear", "pets", "bird"]:
+            self.pool.register(name, Path(f"{name}.pkl"))
+
+    def test_get_loads_once(self, mock_load, mock_nbytes):
+        """Test a model is loaded on the first get and hit afterwards"""
+        mock_load.return_value = MagicMock()
+        first = self.pool.get("bear")
+        second = self.pool.get("bear")
+
+        self.assertIs(first, second)
+        mock_load.assert_called_once_with(Path("bear.pkl"))
+        self.assertEqual(1, self.pool.stats()["loads"])
+        self.assertEqual(1, self.pool.stats()["hits"])
+
+    def test_get_evicts_least_recently_used(self, mock_load, mock_nbytes):
+        """Test the least recently used model is evicted past max_models"""
+        mock_load.side_effect = lambda path: MagicMock()
+        self.pool.get("bear")
+        self.pool.get("pets")
+        self.pool.get("bear")
+        self.pool.get("bird")
+
+        self.assertEqual(["bear", "bird"], self.pool.stats()["loaded"])
+        self.assertEqual(1, self.pool.stats()["evictions"])
+
+    def test_get_evicts_over_memory_budget(self, mock_load, mock_nbytes):
+        """Test models are evicted when over the memory budget"""
+        mock_load.side_effect = lambda path: MagicMock()
+        pool = ModelPool(max_models=3, memory_budget=250)
+        for name in ["bear", "pets", "bird"]:
+            pool.register(name, Path(f"{name}.pkl"))
+            pool.get(name)
+
+        self.assertEqual(["pets", "bird"], pool.stats()["loaded"])
+        self.assertEqual(200, pool.memory_used())
+
+    def test_get_keeps_model_larger_than_budget(self, mock_load, mock_nbytes):
+        """Test the requested model stays loaded even if it alone is over budget"""
+        mock_load.return_value = MagicMock()
+        pool = ModelPool(memory_budget=50)
+        pool.register("bear", Path("bear.pkl"))
+        pool.get("bear")
+
+        self.assertEqual(["bear"], pool.stats()["loaded"])
+
+    def test_get_unregistered_model(self, mock_load, mock_nbytes):
+        """Test getting a model that was never registered"""
+        with self.assertRaises(KeyError):
+            self.pool.get("unknown")
+
+
+if __name__ == '__main__':
+    unittest.main()
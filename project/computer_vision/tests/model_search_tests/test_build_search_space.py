@@ -0,0 +1,32 @@
+"""Module contains tests for build_search_space"""
+import unittest
+
+from project.computer_vision.model_search import build_search_space, trial_name
+
+
+class TestBuildSearchSpace(unittest.TestCase):
+    def test_build_search_space_all_combinations(self):
+        """Test that every combination of the dimensions is returned"""
+        result = build_search_space(["squish", "pad"], ["resnet18", "resnet34"], [1e-3, 2e-3], max_epochs=4)
+        self.assertEqual(8, len(result))
+        self.assertIn({"transforms": "pad", "arch": "resnet34", "lr": 2e-3, "epochs": 4}, result)
+
+    def test_build_search_space_epochs_not_a_dimension(self):
+        """Test every configuration gets the same epoch budget, so no two only differ in epochs"""
+        result = build_search_space(["squish"], ["resnet18"], [1e-3], max_epochs=3)
+        self.assertEqual([{"transforms": "squish", "arch": "resnet18", "lr": 1e-3, "epochs": 3}], result)
+
+    def test_build_search_space_empty_dimension(self):
+        """Test that an empty dimension gives no configurations"""
+        result = build_search_space(["squish"], [], [1e-3])
+        self.assertEqual([], result)
+
+    def test_trial_names_are_unique(self):
+        """Test that every configuration gets its own trial name"""
+        configs = build_search_space(["squish", "pad"], ["resnet18", "resnet34"], [1e-3, 2e-3])
+        names = {trial_name(config) for config in configs}
+        self.assertEqual(len(configs), len(names))
+
+
+if __name__ == '__main__':
+    unittest.main()
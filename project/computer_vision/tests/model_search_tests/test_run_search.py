@@ -0,0 +1,18 @@
+"""Module contains tests for run_search"""
+import unittest
+from pathlib import Path
+
+from project.computer_vision.model_search import run_search
+
+
+class TestRunSearch(unittest.TestCase):
+    def test_run_search_no_configurations(self):
+        """Test an empty search space returns no results instead of raising"""
+        export_dir = Path("test_run_search_export")
+        result = run_search([], lambda config, epochs: 0.0, export_dir, Path("winner.pkl"), cpu_budget=4)
+        self.assertEqual([], result)
+        self.assertFalse(export_dir.exists())
+
+
+if __name__ == '__main__':
+    unittest.main()
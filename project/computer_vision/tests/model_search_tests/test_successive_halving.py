@@ -0,0 +1,70 @@
+"""Module contains tests for successive_halving"""
+import unittest
+
+from project.computer_vision.model_search import successive_halving
+
+# Only set in the test process, a forked worker would inherit it and a spawned one does not
+PARENT_STATE = []
+
+
+def evaluate_parent_state(config, epochs):
+    """Picklable fake trial returning how much parent state the worker process sees"""
+    return float(len(PARENT_STATE))
+
+
+class TestSuccessiveHalving(unittest.TestCase):
+    def setUp(self):
+        """Configurations whose error rate is known up front"""
+        self.configs = [{"name": name, "epochs": 4} for name in "abcdefgh"]
+        self.errors = dict(zip("abcdefgh", [0.5, 0.1, 0.7, 0.3, 0.8, 0.2, 0.6, 0.4]))
+        self.calls = []
+
+    def evaluate(self, config, epochs):
+        """Fake trial, error rate drops slightly with more epochs"""
+        self.calls.append((config["name"], epochs))
+        return self.errors[config["name"]] - epochs / 100
+
+    def test_successive_halving_best_first(self):
+        """Test the best configuration is ranked first and trained for the full budget"""
+        ranked = successive_halving(self.configs, self.evaluate, min_epochs=1, max_epochs=4)
+        self.assertEqual("b", ranked[0]["config"]["name"])
+        self.assertEqual(4, ranked[0]["epochs"])
+        self.assertEqual(len(self.configs), len(ranked))
+
+    def test_successive_halving_drops_weak_configurations(self):
+        """Test weak configurations only get the first rung budget"""
+        successive_halving(self.configs, self.evaluate, min_epochs=1, max_epochs=4)
+        self.assertEqual([1], [epochs for name, epochs in self.calls if name == "e"])
+        self.assertEqual([1, 2, 4], [epochs for name, epochs in self.calls if name == "b"])
+
+    def test_successive_halving_does_not_retrain_short_configurations(self):
+        """Test configurations with fewer epochs than the rung budget are not retrained"""
+        configs = [{"name": name, "epochs": 4} for name in "bcd"] + [{"name": "a", "epochs": 1}]
+        self.errors["a"] = 0.0
+        ranked = successive_halving(configs, self.evaluate, min_epochs=1, max_epochs=4)
+        self.assertEqual(1, len([call for call in self.calls if call[0] == "a"]))
+        self.assertEqual("a", ranked[0]["config"]["name"])
+
+    def test_successive_halving_invalid_reduction_factor(self):
+        """Test a reduction factor that would never grow the budget is rejected"""
+        with self.assertRaises(ValueError):
+            successive_halving(self.configs, self.evaluate, reduction_factor=1)
+
+    def test_successive_halving_spawns_workers(self):
+        """Test parallel trials run in spawned processes that do not inherit the parent's state"""
+        PARENT_STATE.append("cuda initialised")
+        try:
+            ranked = successive_halving(
+                self.configs[:2], evaluate_parent_state, min_epochs=4, max_epochs=4, max_workers=2
+            )
+        finally:
+            PARENT_STATE.clear()
+        self.assertEqual([0.0, 0.0], [result["error_rate"] for result in ranked])
+
+    def test_successive_halving_no_configurations(self):
+        """Test no configurations gives no results"""
+        self.assertEqual([], successive_halving([], self.evaluate))
+
+
+if __name__ == '__main__':
+    unittest.main()
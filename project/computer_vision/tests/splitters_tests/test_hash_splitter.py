@@ -0,0 +1,73 @@
+"""Module contains tests for HashSplitter"""
+import shutil
+import unittest
+from pathlib import Path
+
+from project.computer_vision.splitters import HashSplitter, content_key
+
+
+class TestHashSplitter(unittest.TestCase):
+    def setUp(self):
+        """Fake image paths across two label directories"""
+        self.items = [
+            Path(f"images/{label}/{i:05}.jpg") for label in ["grizzly", "teddy"] for i in range(1000)
+        ]
+        self.test_dir = Path("test_hash_splitter")
+        self.test_dir.mkdir(parents=True, exist_ok=True)
+
+    def tearDown(self):
+        """Remove the test image directory"""
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def valid_items(self, splitter, items):
+        """Return the set of items in the validation set"""
+        _, valid = splitter(items)
+        return {items[i] for i in valid}
+
+    def test_hash_splitter_covers_every_item_once(self):
+        """Test every index is in exactly one of train and valid"""
+        train, valid = HashSplitter()(self.items)
+        self.assertEqual(list(range(len(self.items))), sorted(list(train) + list(valid)))
+
+    def test_hash_splitter_proportion(self):
+        """Test the validation set is close to valid_pct"""
+        _, valid = HashSplitter(valid_pct=0.2)(self.items)
+        self.assertAlmostEqual(0.2, len(valid) / len(self.items), delta=0.03)
+
+    def test_hash_splitter_stable_when_items_added(self):
+        """Test adding items does not move existing items between train and valid"""
+        splitter = HashSplitter()
+        before = self.valid_items(splitter, self.items)
+        added = self.items + [Path(f"images/black/{i:05}.jpg") for i in range(200)]
+        after = self.valid_items(splitter, list(reversed(added)))
+        self.assertEqual(before, after & set(self.items))
+
+    def test_hash_splitter_independent_of_dataset_location(self):
+        """Test moving the dataset directory keeps the split"""
+        moved = [Path("elsewhere") / item.relative_to("images") for item in self.items]
+        self.assertEqual(HashSplitter()(self.items)[1], HashSplitter()(moved)[1])
+
+    def test_hash_splitter_salt_changes_split(self):
+        """Test a different salt gives a different split"""
+        self.assertNotEqual(
+            self.valid_items(HashSplitter(salt="1"), self.items),
+            self.valid_items(HashSplitter(salt="2"), self.items),
+        )
+
+    def test_hash_splitter_content_key(self):
+        """Test hashing content keeps the assignment of renamed files"""
+        splitter = HashSplitter(valid_pct=0.5, key=content_key)
+        paths = []
+        for i in range(20):
+            path = self.test_dir / f"{i}.jpg"
+            path.write_bytes(str(i).encode())
+            paths.append(path)
+        before = [splitter.is_valid(path) for path in paths]
+        for path in paths:
+            path.rename(path.with_name(f"renamed_{path.name}"))
+        after = [splitter.is_valid(path.with_name(f"renamed_{path.name}")) for path in paths]
+        self.assertEqual(before, after)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,38 @@
+"""Module contains tests for save_split and matches_split"""
+import unittest
+from pathlib import Path
+
+from project.computer_vision.splitters import HashSplitter, content_key, matches_split, save_split, split_path
+
+
+class TestMatchesSplit(unittest.TestCase):
+    def setUp(self):
+        """Path of a fake exported learner"""
+        self.model_path = Path("test_matches_split.pkl")
+
+    def tearDown(self):
+        """Remove the split settings"""
+        split_path(self.model_path).unlink(missing_ok=True)
+
+    def test_split_path_next_to_export(self):
+        """Test the split settings are saved next to the export"""
+        self.assertEqual(Path("models/bear1.split.json"), split_path(Path("models/bear1.pkl")))
+
+    def test_matches_saved_split(self):
+        """Test an export matches the splitter it was saved with"""
+        save_split(self.model_path, HashSplitter())
+        self.assertTrue(matches_split(self.model_path, HashSplitter()))
+
+    def test_different_split_does_not_match(self):
+        """Test a different fraction, salt or key does not match"""
+        save_split(self.model_path, HashSplitter())
+        for splitter in [HashSplitter(valid_pct=0.3), HashSplitter(salt="7"), HashSplitter(key=content_key)]:
+            self.assertFalse(matches_split(self.model_path, splitter))
+
+    def test_export_without_split_does_not_match(self):
+        """Test an export saved before split settings existed does not match"""
+        self.assertFalse(matches_split(self.model_path, HashSplitter()))
+
+
+if __name__ == '__main__':
+    unittest.main()